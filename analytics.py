@@ -0,0 +1,246 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Author metric percentiles reported per department
+PERCENTILES = (25, 50, 75, 90)
+
+SOURCES = ('scopus', 'scholar')
+
+# Record sets whose Analytics are kept for reuse (the whole roster and a few
+# filtered ones); each holds every paper of its authors in arrays
+CACHE_SIZE = 4
+
+
+def as_int(value):
+    if isinstance(value, int):
+        return value
+    return int(value) if value and value.isdigit() else 0
+
+
+def as_year(value):
+    value = str(value or '')[:4]
+    return int(value) if value.isdigit() else 0
+
+
+# Integer array of `values` (years, citation counts) converted by `parse`.
+# They repeat a lot, so each distinct value is only converted once.
+def parse_values(values, parse):
+    parsed = {value: parse(value) for value in dict.fromkeys(values)}
+    return np.fromiter(map(parsed.__getitem__, values), np.int64, len(values))
+
+
+def record_papers(record, source):
+    if source == 'scopus':
+        return record['scopus']['papers'] if record['scopus'] else []
+    return record['scholar']['profile']['papers'] if record['scholar'] and record['scholar']['profile'] else []
+
+
+def record_yearly_citations(record):
+    return record['scholar']['profile']['yearly_citations'] if record['scholar'] and record['scholar']['profile'] else {}
+
+
+# Order of the papers in flat arrays grouped by author: by author, then by
+# descending citations
+def author_citation_order(citations, author_index):
+    if not len(citations):
+        return np.arange(0)
+    most = int(citations.max()) + 1
+    return np.argsort(author_index * most + (most - 1 - citations), kind='stable')
+
+
+# Per-author metrics over a flat array of paper citation counts sorted by
+# author_citation_order, where `author_index` says whose paper each one is.
+# Knowing each paper's rank within its author's list, every metric becomes a
+# weighted bincount over authors.
+def paper_metrics(citations, author_index, authors):
+    papers = np.bincount(author_index, minlength=authors)
+    starts = np.concatenate(([0], np.cumsum(papers)[:-1]))
+    rank = np.arange(1, len(citations) + 1) - starts[author_index]
+    running = np.cumsum(citations)
+    running -= np.concatenate(([0], running))[starts][author_index]
+
+    # Both hold for a prefix of each author's papers (the top h papers have at
+    # least h citations each; the top g have at least g^2 between them), so
+    # counting the papers where they hold gives the index
+    h_papers = citations >= rank
+    g_papers = running >= rank * rank
+
+    return {
+        'papers': papers,
+        'citations': np.bincount(author_index, weights=citations, minlength=authors).astype(np.int64),
+        'h_index': np.bincount(author_index, weights=h_papers, minlength=authors).astype(np.int64),
+        'i10_index': np.bincount(author_index, weights=citations >= 10, minlength=authors).astype(np.int64),
+        'g_index': np.bincount(author_index, weights=g_papers, minlength=authors).astype(np.int64),
+    }
+
+
+class Analytics:
+    """Citation metrics for a set of authors, computed for all of them at once.
+
+    Every paper of every author is held in flat NumPy arrays per source
+    (citation count, publication year and the author it belongs to, grouped
+    by author and sorted by descending citations within each), and the
+    Scholar yearly citations in an authors x years matrix. Author metrics
+    (papers, citations, h-index, i10-index, g-index) are computed in one pass
+    per source, and department figures are grouped reductions over those.
+    """
+
+    def __init__(self, author_ids, departments, papers, years, yearly_citations):
+        self.author_ids = author_ids
+        # Department names, and each author's index into them
+        self.departments, self.department_index = np.unique(np.asarray(departments, dtype=str), return_inverse=True)
+        # source -> (citations, publication years, author index) arrays
+        self.papers = papers
+        self.years = years
+        self.yearly_citations = yearly_citations
+        self._metrics = {}
+
+    @classmethod
+    def from_records(cls, records, departments=None):
+        departments = departments or {}
+        author_ids = [record['id'] for record in records]
+
+        papers = {}
+        for source in SOURCES:
+            lists = [record_papers(record, source) for record in records]
+            citations = parse_values([paper['citations'] for paper_list in lists for paper in paper_list], as_int)
+            years = parse_values([paper.get('year') for paper_list in lists for paper in paper_list], as_year)
+            author_index = np.repeat(np.arange(len(records)), [len(paper_list) for paper_list in lists])
+            order = author_citation_order(citations, author_index)
+            papers[source] = (citations[order], years[order], author_index[order])
+
+        histograms = [record_yearly_citations(record) for record in records]
+        histogram_years = parse_values([year for histogram in histograms for year in histogram], as_year)
+        counts = parse_values([count for histogram in histograms for count in histogram.values()], as_int)
+        rows = np.repeat(np.arange(len(records)), [len(histogram) for histogram in histograms])
+        years, columns = np.unique(histogram_years, return_inverse=True)
+        yearly_citations = np.zeros((len(records), len(years)), dtype=np.int64)
+        yearly_citations[rows, columns] = counts
+        if len(years) and years[0] == 0:
+            # Years that could not be read
+            years, yearly_citations = years[1:], yearly_citations[:, 1:]
+
+        return cls(author_ids, [departments.get(author_id, '') for author_id in author_ids], papers, years, yearly_citations)
+
+    def __len__(self):
+        return len(self.author_ids)
+
+    # Metric name -> array with one value per author, for `source`
+    def author_metrics(self, source):
+        if source not in self._metrics:
+            citations, _, author_index = self.papers[source]
+            self._metrics[source] = paper_metrics(citations, author_index, len(self))
+        return self._metrics[source]
+
+    # (years, papers published per year) for each department, for `source`
+    def yearly_papers(self, source):
+        _, years, author_index = self.papers[source]
+        dated = years > 0
+        if not dated.any():
+            return np.arange(0), np.zeros((len(self.departments), 0), dtype=np.int64)
+        first, last = int(years[dated].min()), int(years[dated].max())
+        span = last - first + 1
+        cells = self.department_index[author_index[dated]] * span + (years[dated] - first)
+        counts = np.bincount(cells, minlength=len(self.departments) * span).reshape(len(self.departments), span)
+        return np.arange(first, last + 1), counts
+
+    # (years, Scholar citations per year) for each department
+    def yearly_citation_totals(self):
+        totals = np.zeros((len(self.departments), len(self.years)), dtype=np.int64)
+        np.add.at(totals, self.department_index, self.yearly_citations)
+        return self.years, totals
+
+    def department_sizes(self):
+        return np.bincount(self.department_index, minlength=len(self.departments))
+
+    # Per-department mean of each author metric, for `source`
+    def department_means(self, source):
+        sizes = np.maximum(self.department_sizes(), 1)
+        return {
+            name: np.bincount(self.department_index, weights=values, minlength=len(self.departments)) / sizes
+            for name, values in self.author_metrics(source).items()
+        }
+
+    # Per-department sum of each author metric, for `source`
+    def department_totals(self, source):
+        return {
+            name: np.bincount(self.department_index, weights=values, minlength=len(self.departments)).astype(np.int64)
+            for name, values in self.author_metrics(source).items()
+        }
+
+    # Per-department PERCENTILES of author `metric`, as a departments x
+    # percentiles array (linear interpolation, like np.percentile)
+    def department_percentiles(self, source, metric):
+        values = self.author_metrics(source)[metric]
+        sizes = self.department_sizes()
+        # Authors grouped by department and sorted within it, so each
+        # percentile is an interpolation between two neighbouring positions
+        ordered = values[np.lexsort((values, self.department_index))].astype(np.float64)
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        positions = np.maximum(sizes - 1, 0)[:, None] * (np.array(PERCENTILES) / 100)[None, :]
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        if not len(ordered):
+            return np.zeros((len(sizes), len(PERCENTILES)))
+        low_values = ordered[np.minimum(starts[:, None] + lower, len(ordered) - 1)]
+        high_values = ordered[np.minimum(starts[:, None] + upper, len(ordered) - 1)]
+        return np.where(sizes[:, None] > 0, low_values + (high_values - low_values) * (positions - lower), 0)
+
+    # The same figures for everyone together, as an Analytics with a single
+    # department
+    def overall(self):
+        overall = Analytics(self.author_ids, [''] * len(self), self.papers, self.years, self.yearly_citations)
+        overall._metrics = self._metrics
+        return overall
+
+
+cache = OrderedDict()
+cache_lock = threading.Lock()
+
+
+# What an Analytics built from `records` depends on: each author, department
+# and year range (see reports.limit_years), and when each record part was
+# refreshed, i.e. fetched from the upstream (served from the response cache,
+# a part keeps its fetch time), synced or snapshotted. The Scopus summary is
+# included too, as citation counts are refreshed between syncs. None when a
+# part does not say when it was refreshed.
+def records_fingerprint(records, departments):
+    fingerprint = []
+    for record in records:
+        parts = []
+        for source in SOURCES:
+            part = record[source]
+            if part is None:
+                parts.append(None)
+                continue
+            if part.get('refreshed_at') is None:
+                return None
+            parts.append((part['refreshed_at'], tuple(part.get('summary') or ())))
+        fingerprint.append((record['id'], departments.get(record['id'], ''), tuple(record.get('years') or ()), *parts))
+    return tuple(fingerprint)
+
+
+# Analytics.from_records, reused for as long as the same records come back.
+# Loading the paper lists into arrays walks every paper in Python, which costs
+# about as much as computing the metrics per author would, and is most of an
+# aggregate report's time; it is done once per set of data rather than for
+# every request.
+def for_records(records, departments=None):
+    departments = departments or {}
+    fingerprint = records_fingerprint(records, departments)
+    if fingerprint is None:
+        return Analytics.from_records(records, departments)
+    with cache_lock:
+        stats = cache.get(fingerprint)
+        if stats is not None:
+            cache.move_to_end(fingerprint)
+            return stats
+    # Built outside the lock; two requests racing on a new record set both build it
+    stats = Analytics.from_records(records, departments)
+    with cache_lock:
+        cache[fingerprint] = stats
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+    return stats
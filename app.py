@@ -1,379 +1,183 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, stream_with_context
+from concurrent.futures import Future
+import itertools
 import json
-import requests
-import asyncio
-import aiohttp
-from bs4 import BeautifulSoup
+import threading
+import time
 
-app = Flask(__name__)
-
-# Load your API key from config.json
-with open('config.json') as config_file:
-    config = json.load(config_file)
-
-API_KEY = config['API_KEY']
-
-# Fetch author papers from Scopus using author ID
-def fetch_author_papers(author_id):
-    url = f'https://api.elsevier.com/content/search/scopus?query=AU-ID({author_id})'
-    
-    headers = {
-        'X-ELS-APIKey': API_KEY,
-        'Accept': 'application/json'
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: Unable to fetch data for author ID {author_id}. Status code: {response.status_code}")
-        return None
-
-# Parse Scopus data
-def parse_scopus_data(response_json):
-    total_papers = 0
-    total_citations = 0
-    h_index = 0
-    
-    if response_json and 'search-results' in response_json:
-        entries = response_json['search-results'].get('entry', [])
-        total_papers = len(entries)
-        
-        citations = [int(entry.get('citedby-count', '0')) for entry in entries]
-        total_citations = sum(citations)
-        
-        # Calculate H-index
-        citations.sort(reverse=True)
-        h_index = sum(c >= i + 1 for i, c in enumerate(citations))
-    
-    return total_papers, total_citations, h_index
-
-def fetch_author_papers(author_id):
-    url = f'https://api.elsevier.com/content/search/scopus?query=AU-ID({author_id})'
-    
-    headers = {
-        'X-ELS-APIKey': API_KEY,
-        'Accept': 'application/json'
-    }
-    
-    response = requests.get(url, headers=headers)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: Unable to fetch data for author ID {author_id}. Status code: {response.status_code}")
-        return None
-
-def parse_scopus_papers(response_json):
-    papers = []
-    if response_json and 'search-results' in response_json:
-        entries = response_json['search-results'].get('entry', [])
-        for entry in entries:
-            paper = {
-                'title': entry.get('dc:title'),
-                'year': entry.get('prism:coverDate', '')[:4], 
-                'citations': entry.get('citedby-count'),
-                'link': entry.get('prism:doi')
-            }
-            papers.append(paper)
-    return papers
-
-def fetch_google_scholar_data(gscholar_link):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
-    response = requests.get(gscholar_link, headers=headers)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        try:
-            publication_entries = soup.find_all('tr', class_='gsc_a_tr')
-            total_papers = len(publication_entries)
-
-            citation_count = soup.find('td', class_='gsc_rsb_std')
-            total_citations = int(citation_count.text.strip()) if citation_count else 0
-            
-            # Find the statistics table
-            stats = soup.find_all('td', class_='gsc_rsb_std')
-
-            h_index = 0
-            i10_index = 0
-
-            # Ensure we have enough statistics cells
-            if len(stats) >= 5:
-                h_index = int(stats[2].text.strip()) if stats[2] else 0
-                i10_index = int(stats[4].text.strip()) if stats[4] else 0
-
-            return total_papers, total_citations, h_index, i10_index
-        except (IndexError, ValueError) as e:
-            print(f"Error parsing Google Scholar data for {gscholar_link}: {e}")
-            return None, None, None, None
-    else:
-        print(f"Error fetching Google Scholar data from {gscholar_link}: Status code {response.status_code}")
-        return None, None, None, None
-
-def fetch_yearly_citations(gscholar_link):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
-    response = requests.get(gscholar_link, headers=headers)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        try:
-            yearly_data = {}
-            
-            # Find all the year elements
-            year_elements = soup.find_all('span', class_='gsc_g_t')
-            # Find all the citation count elements
-            citation_elements = soup.find_all('span', class_='gsc_g_al')
-
-            # Iterate over the years and corresponding citations
-            for year_elem, citation_elem in zip(year_elements, citation_elements):
-                year = year_elem.text.strip()
-                citation_count = citation_elem.text.strip()
-
-                # Clean the citation count and convert to int
-                citation_count = int(citation_count) if citation_count.isdigit() else 0
-                yearly_data[year] = citation_count
-
-            return yearly_data
-        
-        except Exception as e:
-            print(f"Error fetching yearly citations: {e}")
-            return {}
-
-    else:
-        print(f"Error fetching Google Scholar data from {gscholar_link}: Status code {response.status_code}")
-        return {}
-
-def fetch_google_scholar_papers(gscholar_link):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
-    response = requests.get(gscholar_link, headers=headers)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, 'html.parser')
-        papers = []
-
-        publication_entries = soup.find_all('tr', class_='gsc_a_tr')
-        for entry in publication_entries:
-            title = entry.find('a', class_='gsc_a_at').text
-            citation_count = entry.find('td', class_='gsc_a_c').text.strip()  # Citation count
-            year = entry.find('span', class_='gsc_a_h gsc_a_hc').text.strip()  # Year of publication
-
-            # Collect details
-            papers.append({
-                'title': title,
-                'citations': citation_count,
-                'year': year,
-                'link': 'https://scholar.google.com' + entry.find('a', class_='gsc_a_at')['data-href']  # Link to paper
-            })
-        return papers
-    else:
-        print(f"Error fetching papers from {gscholar_link}: Status code {response.status_code}")
-        return []
-    
-def fetch_google_scholar_papers(author_url):
-    papers = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    try:
-        response = requests.get(author_url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        if 'Our systems have detected unusual traffic' in soup.text:
-            print(f"CAPTCHA detected for {author_url}. Unable to fetch papers.")
-            return papers
-
-        entries = soup.find_all('tr', class_='gsc_a_tr')
-        
-        if not entries:
-            print(f"No paper entries found for {author_url}. The page structure might have changed.")
-            return papers
+import metrics
+import reports
+import snapshots
+from settings import config, run_upstream, stream_upstream
 
-        for entry in entries:
-            title_element = entry.find('a', class_='gsc_a_at')
-            citations_element = entry.find('a', class_='gsc_a_ac gs_ibl')
-            year_element = entry.find('span', class_='gsc_a_h gsc_a_hc gs_ibl')
-            
-            title = title_element.text.strip() if title_element else 'N/A'
-            link = f"https://scholar.google.com{title_element['href']}" if title_element and 'href' in title_element.attrs else 'N/A'
-            citations = citations_element.text.strip() if citations_element else '0'
-            year = year_element.text.strip() if year_element else 'N/A'
-            
-            # If year is empty, set it to 'N/A'
-            if year == '':
-                year = 'N/A'
-            
-            papers.append({
-                'title': title,
-                'link': link,
-                'citations': citations,
-                'year': year
-            })
-        
-        if not papers:
-            print(f"No papers could be extracted from {author_url}. The page structure might have changed.")
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching papers for {author_url}: {str(e)}")
-    except Exception as e:
-        print(f"Unexpected error while processing {author_url}: {str(e)}")
-    
-    return papers
+app = Flask(__name__)
 
+# Precomputed reports written by scheduler.py; see snapshots.py for the
+# "SNAPSHOTS" settings ("SNAPSHOTS": false always builds reports live)
+snapshot_store = snapshots.SnapshotStore.from_config(config.get('SNAPSHOTS'))
 
 @app.route('/')
 def index():
     return render_template('index.html')
+# Records of `authors` (in that order) from the latest snapshot, fetching only
+# the authors it does not cover live, and where they were served from
+def load_records(source, authors):
+    found = snapshot_store.latest_author_records(author[0] for author in authors) if snapshot_store is not None else {}
+    missing = [author for author in authors if author[0] not in found]
+    if missing:
+        records = run_upstream(reports.fetch_author_records, missing, reports.REPORT_SOURCES[source])
+        found.update((record['id'], record) for record in records)
+    return [found[author[0]] for author in authors], 'live' if missing else 'snapshot'
+
+# Report body, number of matching authors and where the records came from, for
+# a report no whole-report snapshot covers
+def build_live_report(source, query):
+    if reports.is_full_report(query):
+        # Fetch data for all authors concurrently, from the upstreams this report needs
+        records = run_upstream(reports.fetch_author_records, reports.get_roster().authors(), reports.REPORT_SOURCES[source])
+        return jsonify(reports.build_report(source, records)).get_data(), len(records), 'live'
+    authors, paged = reports.select_authors(query)
+    records, served_from = load_records(source, authors[reports.page_slice(query)] if paged else authors)
+    return jsonify(reports.build_report(source, reports.query_records(records, query, paged))).get_data(), len(authors), served_from
+
+# Live report builds in flight in this process, by source and query
+building = {}
+building_lock = threading.Lock()
+
+# Build the report for `source` and `query` with `build()`, unless the same
+# report is already being built for another request: then wait for that build
+# and share its result. Upstream fetches are coalesced per author as well (see
+# upstream.single_flight_many); this also saves assembling the report twice.
+def build_once(source, query, build):
+    key = (source, json.dumps(query, sort_keys=True))
+    with building_lock:
+        future = building.get(key)
+        leader = future is None
+        if leader:
+            future = building[key] = Future()
+    if not leader:
+        metrics.COALESCED.inc(source=source, scope='report')
+        return future.result()
+    try:
+        future.set_result(build())
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with building_lock:
+            del building[key]
+    return future.result()
+
+# Reports for the whole roster, or a slice of it: the request body can filter
+# by "department", "authors" and "year_from"/"year_to", "sort" and "order" the
+# rows, and ask for one "page" of "limit" rows (see reports.parse_report_query).
+# Only the authors on the requested page are looked up, unless sorting on a
+# metric needs every matching author. X-Total-Count is the number of authors
+# matching the filters.
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
     data = request.json
     source = data.get('source')
 
-    # List of authors with Scopus IDs and Google Scholar links
-    author_ids = [
-        ("57223100630", "Dr AMRUTHA", "https://scholar.google.com/citations?user=fzs9d1IAAAAJ&hl=en"),
-        ("55079543700", "Dr ANITA H B", "https://scholar.google.com/citations?user=-ZYIiGAAAAAJ&hl=en"),
-        ("35737586100", "Dr AROKIA PAUL RAJAN R", "https://scholar.google.com/citations?hl=en&user=5Dl7tEYAAAAJ"),
-        ("57189239708", "Dr ASHOK IMMANUEL V", "https://scholar.google.co.in/citations?user=px8Z3Q4AAAAJ&hl=en"),
-        ("55881946700", "Dr BEAULAH SOUNDARABAI P", "https://scholar.google.co.in/citations?user=jTCHV4kAAAAJ&hl=en"),
-        ("57044254900", "Dr CECIL DONALD A", "https://scholar.google.co.in/citations?user=_bbxYHsAAAAJ&hl=en&authuser=1"),
-        ("57055221400", "Dr CHANDRA J", "https://scholar.google.com/citations?user=bn6WQUoAAAAJ"),
-        ("59256484700", "Dr CYNTHIA T", "https://scholar.google.com/citations?hl=en&user=ThELNO0AAAAJ"),
-        ("57162822500", "Dr DEEPA V JOSE", "https://scholar.google.co.in/citations?user=ryhyx4IAAAAJ&hl=en"),
-        ("57205027677", "FABIOLA HAZEL POHRMEN", "https://scholar.google.com/citations?user=prcv4fAAAAAJ&hl=en&oi=ao")
-    ]
-    # Handle fetching Google Scholar paper details
-    if source == 'paperDetails':
-        paper_details = []
-        for author_id, author_name, gscholar_link in author_ids:
-            papers = fetch_google_scholar_papers(gscholar_link)
-            print(f"Google Scholar Papers for {author_name}: {papers}")  # Debug logging
-            paper_details.append({'Name': author_name, 'Papers': papers})
-        return jsonify(paper_details)
-
-    # Handle fetching Scopus paper details
-    elif source == 'paperDetailsScopus':
-        all_authors_data = []
-        for author_id, author_name, _ in author_ids:
-            scopus_response_json = fetch_author_papers(author_id)
-            papers = parse_scopus_papers(scopus_response_json)
-            author_data = {
-                "Name": author_name,
-                "ScopusPapers": papers,
-                "ProfileLink": f"https://www.scopus.com/authid/detail.uri?authorId={author_id}"
-            }
-            all_authors_data.append(author_data)
-        return jsonify(all_authors_data)
-
-    # Handle 'both' option if needed (existing functionality)
-    elif source == 'both':
-        # Your existing code for 'both' option here
-        pass
-
-    # Handle 'average' option if needed (existing functionality)
-    elif source == 'average':
-        # Your existing code for 'average' option here
-        pass
-
-    # Handle 'googleScholarOnly' option if needed (existing functionality)
-    elif source == 'googleScholarOnly':
-        # Your existing code for 'googleScholarOnly' option here
-        pass
-
-    else:
+    if source not in reports.REPORT_SOURCES:
         return jsonify({"error": "Invalid source specified"}), 400
+    try:
+        query = reports.parse_report_query(source, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with metrics.tagged(source=source), metrics.timed(metrics.REPORT_SECONDS, endpoint='generate_report', source=source, served_from='snapshot') as labels:
+        # Serve the latest precomputed snapshot when the scheduler has written a
+        # recent one for the current roster
+        snapshot = snapshot_store.latest_report(source, reports.get_roster().by_id) if snapshot_store is not None and reports.is_full_report(query) else None
+        if snapshot is not None:
+            response = app.response_class(snapshot, mimetype='application/json')
+            total = len(reports.get_roster())
+        else:
+            body, total, labels['served_from'] = build_once(source, query, lambda: build_live_report(source, query))
+            response = app.response_class(body, mimetype='application/json')
+
+    response.headers['X-Total-Count'] = str(total)
+    metrics.REPORT_RESPONSE_BYTES.inc(response.content_length or 0, endpoint='generate_report', source=source)
+    return response
+
+# Streaming variant of /generate_report, taking the same parameters. The
+# response is NDJSON: a first {"total": <rows>, "matched": <authors>} line,
+# then one {"row": ...} line per author as soon as that author's data is
+# ready, so the page can fill in rows progressively.
+@app.route('/generate_report/stream', methods=['POST'])
+def generate_report_stream():
+    data = request.json
+    source = data.get('source')
 
-    # Logic for handling 'both' and 'average' options (existing code) remains here...
-
-    combined_data = []
-
-    # Fetch data for each author
-    for author_id, author_name, gscholar_link in author_ids:
-        scopus_response_json = fetch_author_papers(author_id)
-        total_papers_scopus, total_citations_scopus, h_index_scopus = parse_scopus_data(scopus_response_json)
-        total_papers_gscholar, total_citations_gscholar, h_index_gscholar, i10_index = fetch_google_scholar_data(gscholar_link)
-
-        # Get yearly citations
-        yearly_citations = fetch_yearly_citations(gscholar_link)
-
-        # Convert yearly_citations dictionary to a string format for easy display
-        yearly_citations_str = ', '.join(f"{year}: {count}" for year, count in yearly_citations.items())
-
-        # Append individual author data
-        combined_data.append({
-            'Name': author_name,
-            'Total Papers (Google Scholar)': total_papers_gscholar or 0,
-            'Total Citations (Google Scholar)': total_citations_gscholar or 0,
-            'H-Index (Google Scholar)': h_index_gscholar or 0,
-            'I10 Index (Google Scholar)': i10_index or 0,
-            'Total Papers (Scopus)': total_papers_scopus or 0,
-            'Total Citations (Scopus)': total_citations_scopus or 0,
-            'H-Index (Scopus)': h_index_scopus or 0,
-            'Yearly Citations': yearly_citations_str  # Store as a formatted string
-        })
-
-    # Handle "googleScholarOnly" source
-    if source == 'googleScholarOnly':
-        google_scholar_data = []
-        for entry in combined_data:
-            google_scholar_data.append({
-                'Name': entry['Name'],
-                'Total Citations': entry['Total Citations (Google Scholar)'],
-                'H-Index': entry['H-Index (Google Scholar)'],
-                'I10 Index': entry['I10 Index (Google Scholar)'],
-                'Yearly Citations': entry['Yearly Citations']
-            })
-        return jsonify(google_scholar_data)
-
-    # If source is "average", calculate individual averages per author
-    if source == 'average':
-        avg_data = []
-
-        for entry in combined_data:
-            avg_data.append({
-                'Name': entry['Name'],
-                'Total Papers (Google Scholar)': entry['Total Papers (Google Scholar)'],
-                'Total Citations (Google Scholar)': entry['Total Citations (Google Scholar)'],
-                'H-Index (Google Scholar)': entry['H-Index (Google Scholar)'],
-                'I10 Index (Google Scholar)': entry['I10 Index (Google Scholar)'],
-                'Total Papers (Scopus)': entry['Total Papers (Scopus)'],
-                'Total Citations (Scopus)': entry['Total Citations (Scopus)'],
-                'H-Index (Scopus)': entry['H-Index (Scopus)'],
-                'Yearly Citations': entry['Yearly Citations'],
-            })
-
-        return jsonify(avg_data)
-
-    # Filter data based on the source requested (if not 'average')
-    filtered_data = []
-    for entry in combined_data:
-        filtered_entry = {'Name': entry['Name']}
-        if source == 'googleScholar' or source == 'both':
-            filtered_entry['Total Papers (Google Scholar)'] = entry['Total Papers (Google Scholar)']
-            filtered_entry['Total Citations (Google Scholar)'] = entry['Total Citations (Google Scholar)']
-            filtered_entry['H-Index (Google Scholar)'] = entry['H-Index (Google Scholar)']
-            filtered_entry['I10 Index (Google Scholar)'] = entry['I10 Index (Google Scholar)']
-            filtered_entry['Yearly Citations'] = entry['Yearly Citations']
-        if source == 'scopus' or source == 'both':
-            filtered_entry['Total Papers (Scopus)'] = entry['Total Papers (Scopus)']
-            filtered_entry['Total Citations (Scopus)'] = entry['Total Citations (Scopus)']
-            filtered_entry['H-Index (Scopus)'] = entry['H-Index (Scopus)']
-
-        filtered_data.append(filtered_entry)
-
-
-    return jsonify(filtered_data)
+    if source not in reports.REPORT_SOURCES:
+        return jsonify({"error": "Invalid source specified"}), 400
+    try:
+        query = reports.parse_report_query(source, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    full = reports.is_full_report(query)
+    snapshot = snapshot_store.latest_report(source, reports.get_roster().by_id) if snapshot_store is not None and full else None
+
+    def generate():
+        started = time.perf_counter()
+        sent = 0
+        served_from = 'live'
+        with metrics.tagged(source=source):
+            if snapshot is not None:
+                rows = json.loads(snapshot)
+                total = matched = len(rows)
+                served_from = 'snapshot'
+            else:
+                authors, paged = reports.select_authors(query)
+                matched = len(authors)
+                if full or paged:
+                    # Rows in the order authors complete: those in the latest
+                    # snapshot right away, then the rest as they are fetched
+                    authors = authors[reports.page_slice(query)]
+                    found = snapshot_store.latest_author_records(author[0] for author in authors) if snapshot_store is not None and not full else {}
+                    missing = [author for author in authors if author[0] not in found]
+                    records = itertools.chain(
+                        (found[author[0]] for author in authors if author[0] in found),
+                        stream_upstream(reports.stream_author_records, missing, reports.REPORT_SOURCES[source]) if missing else (),
+                    )
+                    records = (reports.limit_years(record, query['year_from'], query['year_to']) for record in records)
+                    served_from = 'live' if missing else 'snapshot'
+                else:
+                    records, served_from = load_records(source, authors)
+                    records = reports.query_records(records, query, paged)
+                if source == 'aggregate':
+                    # Department rows need every author's data first
+                    rows = reports.build_report(source, list(records))
+                    total = len(rows)
+                else:
+                    rows = (reports.build_report(source, [record])[0] for record in records)
+                    total = len(authors) if full or paged else len(records)
+
+            for message in itertools.chain([{'total': total, 'matched': matched}], ({'row': row} for row in rows)):
+                line = json.dumps(message) + '\n'
+                sent += len(line)
+                yield line
+
+        metrics.observe(metrics.REPORT_SECONDS, time.perf_counter() - started, endpoint='generate_report_stream', source=source, served_from=served_from)
+        metrics.REPORT_RESPONSE_BYTES.inc(sent, endpoint='generate_report_stream', source=source)
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+# When each author in the latest snapshot was last refreshed from Scopus and
+# Scholar (Unix times, null where that upstream never answered)
+@app.route('/refresh_times')
+def refresh_times():
+    if snapshot_store is None:
+        return jsonify({"error": "Snapshots are turned off"}), 404
+    return jsonify(snapshot_store.refresh_times())
+
+
+# Prometheus scrape endpoint; see metrics.py for what is collected
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,651 @@
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import mock_upstream
+
+# Benchmarks against mock_upstream.py.
+#
+# reports: end-to-end run of each report source (plus combine.py's main) for
+# synthetic rosters of the requested sizes, reporting the latency, upstream
+# requests per author, bytes transferred and CPU spent parsing per run.
+#
+# parse: CPU per Scholar profile for the lxml extraction against the
+# BeautifulSoup reference parser, on mock profile pages or saved ones.
+#
+# analytics: time for the NumPy analytics engine to load a synthetic roster's
+# records and compute every author and department metric, on a new record set
+# and on one whose arrays are reused, checked against per-author Python.
+#
+# match: Scopus/Scholar paper matching for a synthetic department whose
+# Scholar lists hold altered copies of the Scopus titles, against comparing
+# every pair of titles.
+#
+# startup: cold start of the web app, as after an idle period on Vercel or a
+# gunicorn worker restart. Every run is a fresh interpreter that imports
+# app.py and makes one request, reporting the import time, the first
+# request's latency and a second (warm) request's for each route.
+
+DEFAULT_SIZES = [10, 100]
+DEFAULT_PROFILES = 50
+DEFAULT_ANALYTICS_AUTHORS = 5000
+DEFAULT_DEPARTMENTS = 20
+DEFAULT_MATCH_AUTHORS = 200
+DEFAULT_STARTUP_AUTHORS = 20
+MOCK_HOSTS = ['api.elsevier.com', 'scholar.google']
+UNLIMITED_RATE = {'rate': 100000, 'burst': 100000}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def mock_request(base_url, path, method='GET'):
+    with urllib.request.urlopen(urllib.request.Request(base_url + path, method=method), timeout=5) as response:
+        return json.load(response)
+
+
+def start_mock(args):
+    port = free_port()
+    command = [sys.executable, mock_upstream.__file__, '--port', str(port),
+               '--scopus-latency', str(args.scopus_latency), '--scholar-latency', str(args.scholar_latency),
+               '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+               '--throttle-rate', str(args.throttle_rate), '--captcha-rate', str(args.captcha_rate),
+               '--max-papers', str(args.max_papers)]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 15
+    while True:
+        try:
+            mock_request(base_url, '/_mock/stats')
+            return process, base_url
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                raise SystemExit('Mock upstream failed to start')
+            time.sleep(0.1)
+
+
+# config.json for the app under test: the base config (if any) with every
+# upstream pointed at the mock, snapshots off and, unless asked otherwise, the
+# response cache off and the rate limits lifted. `overrides` are set last.
+def write_config(args, base_url, workdir, **overrides):
+    config = {}
+    if args.config:
+        with open(args.config) as config_file:
+            config = json.load(config_file)
+    config.setdefault('API_KEY', 'benchmark')
+    config['UPSTREAM_URLS'] = {host: base_url for host in MOCK_HOSTS}
+    config['SNAPSHOTS'] = False
+    config['CACHE'] = {'path': os.path.join(workdir, 'cache.sqlite3')} if args.cache else False
+    if not args.production_limits:
+        config['RATE_LIMITS'] = {host: UNLIMITED_RATE for host in MOCK_HOSTS}
+    config.update(overrides)
+
+    path = os.path.join(workdir, 'config.json')
+    with open(path, 'w') as config_file:
+        json.dump(config, config_file)
+    return path
+
+
+class ParseTimer:
+    """CPU time spent in the parsing and report-building functions, summed over
+    every thread that calls them (they run on the upstream client's loop thread
+    as well as the request thread)."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, name):
+        fn = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            started = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.seconds += time.thread_time() - started
+
+        setattr(owner, name, timed)
+
+    def reset(self):
+        with self._lock:
+            self.seconds = 0.0
+
+
+def run_case(app, combine, source, roster, stream):
+    if source == 'combine':
+        combine.main(roster)
+        return len(roster), None
+
+    client = app.test_client()
+    if not stream:
+        response = client.post('/generate_report', json={'source': source})
+        return len(response.get_json()), None
+
+    started = time.perf_counter()
+    first_row = None
+    rows = 0
+    with client.post('/generate_report/stream', json={'source': source}, buffered=False) as response:
+        for line in response.response:
+            if b'"row"' in line:
+                rows += 1
+                if first_row is None:
+                    first_row = time.perf_counter() - started
+    return rows, first_row
+
+
+def run_reports(args):
+    output = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp(prefix='gsc_sco_bench_')
+    mock, base_url = start_mock(args)
+    try:
+        os.environ['GSC_SCO_CONFIG'] = write_config(args, base_url, workdir)
+        # combine.py writes its spreadsheet to the working directory
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+        import app
+        import combine
+        import reports
+        import roster
+        import scholar
+        import settings
+        import throttle
+        import upstream
+
+        timer = ParseTimer()
+        timer.wrap(scholar, 'parse_profile')
+        timer.wrap(upstream.Response, 'json')
+        timer.wrap(reports, 'build_report')
+
+        sources = args.sources or list(reports.REPORT_SOURCES) + ['combine']
+        results = []
+        print(f"{'authors':>7} {'source':<18} {'run':>3} {'seconds':>8} {'first row':>9} {'req/author':>10} "
+              f"{'KB':>9} {'parse cpu':>9} {'cpu':>7} {'rows':>5}")
+        for size in args.authors:
+            authors = mock_upstream.synthetic_roster(size)
+            reports.ROSTER = roster.Roster.from_authors(authors)
+            for source in sources:
+                for run in range(1, args.repeat + 1):
+                    # Start every run with fresh throttles (a CAPTCHA in one run
+                    # would otherwise pause Scholar for the rest)
+                    throttle.configure(settings.config.get('RATE_LIMITS'), settings.config.get('RETRIES', throttle.DEFAULT_RETRIES))
+                    mock_request(base_url, '/_mock/reset', 'POST')
+                    timer.reset()
+
+                    cpu_started = time.process_time()
+                    started = time.perf_counter()
+                    rows, first_row = run_case(app.app, combine, source, authors, args.stream)
+                    elapsed = time.perf_counter() - started
+                    cpu = time.process_time() - cpu_started
+
+                    stats = mock_request(base_url, '/_mock/stats')
+                    requests_made = sum(stats['requests'].values())
+                    result = {
+                        'authors': size,
+                        'source': source,
+                        'run': run,
+                        'seconds': elapsed,
+                        'first_row_seconds': first_row,
+                        'requests': stats['requests'],
+                        'requests_per_author': requests_made / size,
+                        'bytes': stats['bytes'],
+                        'parse_cpu_seconds': timer.seconds,
+                        'cpu_seconds': cpu,
+                        'rows': rows,
+                        'errors': stats['errors'],
+                        'throttled': stats['throttled'],
+                        'captchas': stats['captchas'],
+                    }
+                    results.append(result)
+                    first_row_text = f'{first_row:9.3f}' if first_row is not None else f"{'-':>9}"
+                    print(f"{size:>7} {source:<18} {run:>3} {elapsed:8.3f} {first_row_text} "
+                          f"{result['requests_per_author']:10.2f} {sum(stats['bytes'].values()) / 1024:9.1f} "
+                          f"{timer.seconds:9.3f} {cpu:7.3f} {rows:>5}", flush=True)
+
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            print(f"Results saved to {output}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def load_pages(args):
+    if args.pages:
+        pages = []
+        for name in sorted(os.listdir(args.pages)):
+            with open(os.path.join(args.pages, name), 'rb') as page_file:
+                pages.append((name, page_file.read()))
+        return pages
+    users = [link.split('user=')[1].split('&')[0] for _, _, link in mock_upstream.synthetic_roster(args.profiles)]
+    return [(user, mock_upstream.scholar_profile_page(user, pagesize=args.pagesize, max_papers=args.max_papers)) for user in users]
+
+
+def time_parser(parse, pages, repeat):
+    results = []
+    started = time.process_time()
+    for _ in range(repeat):
+        results = [parse(page, name) for name, page in pages]
+    return (time.process_time() - started) / (repeat * len(pages)), results
+
+
+def run_parse(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import scholar
+
+    pages = load_pages(args)
+    if not pages:
+        raise SystemExit('No profile pages to parse')
+
+    soup_seconds, soup_profiles = time_parser(scholar.parse_profile_soup, pages, args.repeat)
+    lxml_seconds, lxml_profiles = time_parser(scholar.extract_profile, pages, args.repeat)
+    mismatches = [name for (name, _), expected, actual in zip(pages, soup_profiles, lxml_profiles) if expected != actual]
+
+    size = sum(len(page) for _, page in pages) / len(pages)
+    print(f"{len(pages)} profiles, {size / 1024:.1f} KB on average")
+    print(f"BeautifulSoup (html.parser): {soup_seconds * 1000:8.3f} ms CPU per profile")
+    print(f"lxml extraction:             {lxml_seconds * 1000:8.3f} ms CPU per profile ({soup_seconds / lxml_seconds:.1f}x faster)")
+    if mismatches:
+        print(f"Output differs from the reference parser for: {', '.join(mismatches)}")
+        raise SystemExit(1)
+
+
+# Author records for `size` mock authors, without going through the mock server
+def synthetic_records(size, max_papers):
+    records = []
+    for author_id, name, link in mock_upstream.synthetic_roster(size):
+        scopus_papers = [{'year': str(paper['year']), 'citations': str(paper['citations'])}
+                         for paper in mock_upstream.author_papers(author_id, max_papers)]
+        scholar_papers = [{'year': str(paper['year']), 'citations': str(paper['citations'])}
+                          for paper in mock_upstream.author_papers(link, max_papers)]
+        yearly_citations = {}
+        for paper in scholar_papers:
+            yearly_citations[paper['year']] = yearly_citations.get(paper['year'], 0) + int(paper['citations'])
+        records.append({
+            'id': author_id,
+            'name': name,
+            'link': link,
+            'scopus': {'papers': scopus_papers, 'refreshed_at': 0},
+            'scholar': {'profile': {'papers': scholar_papers, 'yearly_citations': yearly_citations}, 'refreshed_at': 0},
+        })
+    return records
+
+
+# h-index, i10-index and g-index of one author, the way reports used to
+# compute them: sort the citation counts and walk them
+def python_metrics(papers):
+    citations = sorted((int(paper['citations']) for paper in papers), reverse=True)
+    h_index = sum(c >= i + 1 for i, c in enumerate(citations))
+    running = g_index = 0
+    for i, c in enumerate(citations):
+        running += c
+        if running >= (i + 1) ** 2:
+            g_index = i + 1
+    return h_index, sum(c >= 10 for c in citations), g_index
+
+
+def run_analytics(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import analytics
+
+    records = synthetic_records(args.authors, args.max_papers)
+    departments = {record['id']: f'Department {index % args.departments}' for index, record in enumerate(records)}
+    papers = sum(len(analytics.record_papers(record, source)) for record in records for source in analytics.SOURCES)
+
+    def compute(stats):
+        for source in analytics.SOURCES:
+            stats.department_totals(source)
+            stats.department_means(source)
+            stats.department_percentiles(source, 'h_index')
+            stats.yearly_papers(source)
+        stats.yearly_citation_totals()
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        stats = analytics.Analytics.from_records(records, departments)
+    load_seconds = (time.perf_counter() - started) / args.repeat
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        stats._metrics = {}
+        compute(stats)
+    compute_seconds = (time.perf_counter() - started) / args.repeat
+
+    # What an aggregate report costs: loading and computing for a record set
+    # seen for the first time, then only looking it up and computing while the
+    # same snapshot or sync state is served again
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        analytics.cache.clear()
+        compute(analytics.for_records(records, departments))
+    total_seconds = (time.perf_counter() - started) / args.repeat
+
+    analytics.cache.clear()
+    analytics.for_records(records, departments)
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        reused = analytics.for_records(records, departments)
+        reused._metrics = {}
+        compute(reused)
+    reused_seconds = (time.perf_counter() - started) / args.repeat
+
+    started = time.perf_counter()
+    expected = {source: [python_metrics(analytics.record_papers(record, source)) for record in records] for source in analytics.SOURCES}
+    python_seconds = time.perf_counter() - started
+
+    print(f"{len(records)} authors, {papers} papers, {args.departments} departments")
+    print(f"Loading records into arrays:           {load_seconds * 1000:8.1f} ms")
+    print(f"Author and department metrics (NumPy): {compute_seconds * 1000:8.1f} ms")
+    print(f"Load + metrics, new records:           {total_seconds * 1000:8.1f} ms")
+    print(f"Load + metrics, arrays reused:         {reused_seconds * 1000:8.1f} ms")
+    print(f"Author metrics only (per-author Python):{python_seconds * 1000:7.1f} ms")
+    for source in analytics.SOURCES:
+        author_metrics = stats.author_metrics(source)
+        actual = list(zip(author_metrics['h_index'].tolist(), author_metrics['i10_index'].tolist(), author_metrics['g_index'].tolist()))
+        if actual != expected[source]:
+            print(f"{source} metrics differ from the per-author computation")
+            raise SystemExit(1)
+
+
+# Scholar's version of a Scopus title: the same words with the kind of
+# differences seen between the two (case, punctuation, a typo, a word
+# dropped or swapped)
+def altered_title(title, rng):
+    words = title.split()
+    change = rng.choice(['case', 'punctuation', 'typo', 'drop', 'swap', 'none'])
+    if change == 'case':
+        words = [word.capitalize() for word in words]
+    elif change == 'punctuation':
+        position = rng.randrange(1, len(words))
+        words[position - 1] += rng.choice([':', ',', ' -'])
+        words[-1] += '.'
+    elif change == 'typo':
+        position = rng.randrange(len(words))
+        word = words[position]
+        at = rng.randrange(len(word))
+        words[position] = word[:at] + rng.choice('aeiourst') + word[at + 1:]
+    elif change == 'drop' and len(words) > 6:
+        del words[rng.randrange(len(words))]
+    elif change == 'swap':
+        words.insert(rng.randrange(len(words)), rng.choice(['of', 'on', 'for', 'the', 'a']))
+    return ' '.join(words)
+
+
+# Title vocabulary: a few function words that appear everywhere, and subject
+# words drawn with Zipf-like frequencies (the mock's own titles share a few
+# dozen words, which makes every title look alike)
+STOP_WORDS = ['of', 'the', 'for', 'a', 'and', 'in', 'using', 'based', 'on', 'with']
+
+
+def title_words(rng, vocabulary_size):
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 11))) for _ in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    return vocabulary, weights
+
+
+# Paper lists of `size` mock authors: Scopus' from the mock, Scholar's with
+# an altered copy of most Scopus papers plus papers of its own, and the
+# (scopus_index, scholar_index) pairs that should match
+def synthetic_paper_lists(size, max_papers, seed):
+    rng = random.Random(seed)
+    vocabulary, weights = title_words(rng, 20000)
+
+    def title(paper):
+        words = rng.choices(vocabulary, weights, k=rng.randint(4, 10))
+        for _ in range(rng.randint(1, 3)):
+            words.insert(rng.randrange(len(words)), rng.choice(STOP_WORDS))
+        return ' '.join(words).capitalize()
+
+    authors = []
+    for author_id, _, link in mock_upstream.synthetic_roster(size):
+        scopus_papers = [{'title': title(paper), 'year': str(paper['year']), 'citations': str(paper['citations']),
+                          'link': f'10.5555/mock.{author_id}.{index}'}
+                         for index, paper in enumerate(mock_upstream.author_papers(author_id, max_papers))]
+        scholar_papers = []
+        expected = set()
+        for index, paper in enumerate(scopus_papers):
+            if rng.random() < 0.85:
+                year = int(paper['year']) + (rng.choice([-1, 1]) if rng.random() < 0.2 else 0)
+                expected.add((index, len(scholar_papers)))
+                scholar_papers.append({'title': altered_title(paper['title'], rng), 'year': str(year),
+                                       'citations': str(int(paper['citations']) + rng.randint(0, 5)), 'link': 'N/A'})
+        scholar_papers += [{'title': title(paper), 'year': str(paper['year']), 'citations': str(paper['citations']), 'link': 'N/A'}
+                           for paper in mock_upstream.author_papers(link, max_papers // 4)]
+        order = list(range(len(scholar_papers)))
+        rng.shuffle(order)
+        position = {old: new for new, old in enumerate(order)}
+        authors.append(([paper for paper in scopus_papers],
+                        [scholar_papers[old] for old in order],
+                        {(scopus_index, position[scholar_index]) for scopus_index, scholar_index in expected}))
+    return authors
+
+
+# Matching by scoring every Scopus title against every Scholar one, for
+# comparison
+def match_pairwise(scopus_papers, scholar_papers, threshold):
+    import matching
+
+    scopus_keys = matching.PaperKeys(scopus_papers)
+    scholar_keys = matching.PaperKeys(scholar_papers)
+    scores = sorted(
+        (-matching.jaccard(scopus_ngrams, scholar_ngrams), scopus_index, scholar_index)
+        for scopus_index, scopus_ngrams in enumerate(map(scopus_keys.ngrams, range(len(scopus_papers))))
+        for scholar_index, scholar_ngrams in enumerate(map(scholar_keys.ngrams, range(len(scholar_papers))))
+        if scopus_ngrams and scholar_ngrams
+        and matching.years_match(scopus_keys.years[scopus_index], scholar_keys.years[scholar_index])
+    )
+    pairs = set()
+    scopus_done, scholar_done = set(), set()
+    for score, scopus_index, scholar_index in scores:
+        if -score < threshold:
+            break
+        if scopus_index not in scopus_done and scholar_index not in scholar_done:
+            scopus_done.add(scopus_index)
+            scholar_done.add(scholar_index)
+            pairs.add((scopus_index, scholar_index))
+    return pairs
+
+
+def run_match(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import matching
+
+    threshold = args.threshold or matching.DEFAULT_THRESHOLD
+    authors = synthetic_paper_lists(args.authors, args.max_papers, args.seed)
+    for scopus_papers, _, _ in authors:
+        # Scholar rows carry no DOI, so leave Scopus' out too and match on titles
+        for paper in scopus_papers:
+            paper['link'] = None
+    papers = sum(len(scopus_papers) + len(scholar_papers) for scopus_papers, scholar_papers, _ in authors)
+
+    started = time.perf_counter()
+    found = [matching.match_papers(scopus_papers, scholar_papers, threshold) for scopus_papers, scholar_papers, _ in authors]
+    index_seconds = time.perf_counter() - started
+
+    expected = sum(len(pairs) for _, _, pairs in authors)
+    correct = sum(len({(a, b) for a, b, _ in pairs} & truth) for pairs, (_, _, truth) in zip(found, authors))
+    matched = sum(len(pairs) for pairs in found)
+    print(f"{args.authors} authors, {papers} papers, {expected} true pairs")
+    print(f"Indexed matching:  {index_seconds * 1000:8.1f} ms, {matched} pairs, "
+          f"precision {correct / max(matched, 1):.4f}, recall {correct / max(expected, 1):.4f}")
+
+    # Everyone's papers in one match, as when deduplicating a department's
+    # publications: far too many pairs to compare them all
+    scopus_all = [paper for scopus_papers, _, _ in authors for paper in scopus_papers]
+    scholar_all = [paper for _, scholar_papers, _ in authors for paper in scholar_papers]
+    started = time.perf_counter()
+    department_pairs = matching.match_papers(scopus_all, scholar_all, threshold)
+    department_seconds = time.perf_counter() - started
+    print(f"Department at once: {department_seconds * 1000:7.1f} ms, {len(department_pairs)} pairs "
+          f"({len(scopus_all)} x {len(scholar_all)} = {len(scopus_all) * len(scholar_all) / 1e6:.0f}M possible)")
+
+    if args.pairwise:
+        started = time.perf_counter()
+        pairwise = [match_pairwise(scopus_papers, scholar_papers, threshold) for scopus_papers, scholar_papers, _ in authors]
+        pairwise_seconds = time.perf_counter() - started
+        differ = sum(set((a, b) for a, b, _ in pairs) != other for pairs, other in zip(found, pairwise))
+        print(f"Pairwise matching: {pairwise_seconds * 1000:8.1f} ms ({pairwise_seconds / index_seconds:.1f}x slower), "
+              f"results differ for {differ} authors")
+
+
+# Routes the startup benchmark can request: name -> (method, path, JSON body)
+STARTUP_ROUTES = {
+    'index': ('GET', '/', None),
+    'metrics': ('GET', '/metrics', None),
+    'report': ('POST', '/generate_report', {'source': 'both'}),
+    'stream': ('POST', '/generate_report/stream', {'source': 'both'}),
+    'aggregate': ('POST', '/generate_report', {'source': 'aggregate'}),
+}
+
+# Dependencies that are slow to import, reported when a route loaded them
+HEAVY_MODULES = ['aiohttp', 'bs4', 'lxml', 'numpy', 'pandas', 'requests']
+
+# Run in a fresh interpreter per measurement: import the app, then time two
+# requests to one route through Flask's test client
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+client = app.app.test_client()
+seconds = []
+for _ in range(2):
+    request_started = time.perf_counter()
+    response = client.open(PATH, method=METHOD, json=BODY)
+    response.get_data()
+    seconds.append(time.perf_counter() - request_started)
+print(json.dumps({
+    'import_seconds': imported - started,
+    'first_request_seconds': seconds[0],
+    'second_request_seconds': seconds[1],
+    'status': response.status_code,
+    'imported': loaded,
+    'requested': [name for name in HEAVY_MODULES if name in sys.modules and name not in loaded],
+}))
+"""
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_startup(args):
+    output = os.path.abspath(args.output) if args.output else None
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+
+    workdir = tempfile.mkdtemp(prefix='gsc_sco_bench_')
+    mock, base_url = start_mock(args)
+    try:
+        roster_path = os.path.join(workdir, 'roster.json')
+        with open(roster_path, 'w') as roster_file:
+            json.dump(mock_upstream.synthetic_roster(args.authors), roster_file)
+        env = dict(os.environ, GSC_SCO_CONFIG=write_config(args, base_url, workdir, ROSTER=roster_path))
+
+        results = []
+        print(f"{'route':<10} {'runs':>4} {'import p50':>10} {'p99':>7} {'first p50':>9} {'p99':>7} "
+              f"{'second p50':>10}  heavy imports (at import / first request)")
+        for name in args.routes:
+            method, path, body = STARTUP_ROUTES[name]
+            probe = f'HEAVY_MODULES = {HEAVY_MODULES!r}\nMETHOD = {method!r}\nPATH = {path!r}\nBODY = {body!r}\n' + STARTUP_PROBE
+            runs = []
+            for _ in range(args.repeat):
+                mock_request(base_url, '/_mock/reset', 'POST')
+                completed = subprocess.run([sys.executable, '-c', probe], cwd=package_dir, env=env,
+                                           capture_output=True, text=True, check=True)
+                runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+            summary = {'route': name, 'runs': runs}
+            for key in ('import_seconds', 'first_request_seconds', 'second_request_seconds'):
+                summary[key] = {'p50': percentile([run[key] for run in runs], 50), 'p99': percentile([run[key] for run in runs], 99)}
+            results.append(summary)
+            print(f"{name:<10} {len(runs):>4} {summary['import_seconds']['p50'] * 1000:8.1f}ms "
+                  f"{summary['import_seconds']['p99'] * 1000:5.0f}ms {summary['first_request_seconds']['p50'] * 1000:7.1f}ms "
+                  f"{summary['first_request_seconds']['p99'] * 1000:5.0f}ms {summary['second_request_seconds']['p50'] * 1000:8.1f}ms  "
+                  f"{', '.join(runs[-1]['imported']) or '-'} / {', '.join(runs[-1]['requested']) or '-'}", flush=True)
+
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            print(f"Results saved to {output}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks against a mock Scopus/Scholar upstream.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    reports_parser = commands.add_parser('reports', help='end-to-end report generation')
+    reports_parser.add_argument('--authors', type=int, nargs='+', default=DEFAULT_SIZES, help='roster sizes to run (10 to 5000)')
+    reports_parser.add_argument('--sources', nargs='+', help='report sources to run, and/or "combine" (default: all)')
+    reports_parser.add_argument('--repeat', type=int, default=1, help='runs per source and roster size')
+    reports_parser.add_argument('--stream', action='store_true', help='use /generate_report/stream and report time to first row')
+    reports_parser.add_argument('--cache', action='store_true', help='keep the response cache on (shared by all runs)')
+    reports_parser.add_argument('--production-limits', action='store_true', help='keep the configured per-host rate limits')
+    reports_parser.add_argument('--config', help='config.json to start from, e.g. the deployment one (default: none)')
+    reports_parser.add_argument('--output', help='also write the results as JSON to this file')
+    mock_upstream.add_arguments(reports_parser)
+    reports_parser.set_defaults(run=run_reports)
+
+    parse_parser = commands.add_parser('parse', help='Scholar profile parse CPU')
+    parse_parser.add_argument('--profiles', type=int, default=DEFAULT_PROFILES, help='mock profile pages to parse')
+    parse_parser.add_argument('--pagesize', type=int, default=mock_upstream.SCHOLAR_MAX_PAGE_SIZE, help='papers listed per mock page')
+    parse_parser.add_argument('--max-papers', type=int, default=mock_upstream.DEFAULT_MAX_PAPERS, help='most papers a mock author has')
+    parse_parser.add_argument('--pages', help='directory of saved profile pages to parse instead of mock ones')
+    parse_parser.add_argument('--repeat', type=int, default=3, help='passes over the pages per parser')
+    parse_parser.set_defaults(run=run_parse)
+
+    analytics_parser = commands.add_parser('analytics', help='department metrics computation time')
+    analytics_parser.add_argument('--authors', type=int, default=DEFAULT_ANALYTICS_AUTHORS, help='synthetic authors')
+    analytics_parser.add_argument('--departments', type=int, default=DEFAULT_DEPARTMENTS, help='departments they are spread over')
+    analytics_parser.add_argument('--max-papers', type=int, default=mock_upstream.DEFAULT_MAX_PAPERS, help='most papers an author has')
+    analytics_parser.add_argument('--repeat', type=int, default=5, help='runs to average over')
+    analytics_parser.set_defaults(run=run_analytics)
+
+    match_parser = commands.add_parser('match', help='Scopus/Scholar paper matching')
+    match_parser.add_argument('--authors', type=int, default=DEFAULT_MATCH_AUTHORS, help='synthetic authors in the department')
+    match_parser.add_argument('--max-papers', type=int, default=mock_upstream.DEFAULT_MAX_PAPERS, help='most Scopus papers an author has')
+    match_parser.add_argument('--threshold', type=float, default=None, help='fuzzy title similarity threshold (default: matching.DEFAULT_THRESHOLD)')
+    match_parser.add_argument('--seed', type=int, default=0, help='seed for the title alterations')
+    match_parser.add_argument('--pairwise', action='store_true', help='also run the all-pairs comparison')
+    match_parser.set_defaults(run=run_match)
+
+    startup_parser = commands.add_parser('startup', help='cold start import time and first request latency')
+    startup_parser.add_argument('--routes', nargs='+', choices=list(STARTUP_ROUTES), default=list(STARTUP_ROUTES), help='routes to request')
+    startup_parser.add_argument('--repeat', type=int, default=10, help='fresh processes per route')
+    startup_parser.add_argument('--authors', type=int, default=DEFAULT_STARTUP_AUTHORS, help='synthetic roster size for the report routes')
+    startup_parser.add_argument('--cache', action='store_true', help='keep the response cache on (shared by all runs)')
+    startup_parser.add_argument('--production-limits', action='store_true', help='keep the configured per-host rate limits')
+    startup_parser.add_argument('--config', help='config.json to start from, e.g. the deployment one (default: none)')
+    startup_parser.add_argument('--output', help='also write the results as JSON to this file')
+    mock_upstream.add_arguments(startup_parser)
+    startup_parser.set_defaults(run=run_startup)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'gsc_sco_cache.sqlite3')
+DEFAULT_MAX_MB = 256
+
+# Citation counts change at most daily upstream
+DEFAULT_TTL = 24 * 60 * 60
+
+# How long past its TTL an entry may still be served while it is refreshed in
+# the background. Older entries are treated as misses.
+DEFAULT_STALE_TTL = 7 * 24 * 60 * 60
+
+# Longest a worker process may hold the lease on a key it is fetching (see
+# acquire); other workers wait for it at most this long. Leases of processes
+# that have exited are dropped right away.
+DEFAULT_LEASE_SECONDS = 10 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    is_json INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (source, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS leases (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (source, key)
+);
+'''
+
+
+class Cache:
+    """Disk-backed cache for upstream responses and parsed per-author results.
+
+    Entries are grouped by source (e.g. "scholar", "scopus_http"), each with its
+    own TTL. Bytes values are stored as-is, anything else as JSON. When the file
+    grows past max_mb the least recently used entries are evicted.
+
+    The same file coordinates the worker processes sharing it: a process about
+    to fetch a key leases it first, and the others wait for the lease to be
+    released and read the stored value instead of fetching it too.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_mb=DEFAULT_MAX_MB, ttl=None, stale_ttl=DEFAULT_STALE_TTL, refresh_workers=2,
+                 lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl or {}
+        self.stale_ttl = stale_ttl
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._page_size = self._db.execute('PRAGMA page_size').fetchone()[0]
+        # Guards only _refreshing, so revalidate never waits on a database call
+        self._refreshing_lock = threading.Lock()
+        self._refreshing = set()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='cache-refresh')
+
+    @classmethod
+    def from_config(cls, cache_config):
+        # `"CACHE": false` in config.json turns caching off; a cache that
+        # cannot be opened (e.g. read-only filesystem) is skipped as well
+        if cache_config is False:
+            return None
+        cache_config = cache_config or {}
+        try:
+            return cls(
+                path=cache_config.get('path', DEFAULT_PATH),
+                max_mb=cache_config.get('max_mb', DEFAULT_MAX_MB),
+                ttl=cache_config.get('ttl'),
+                stale_ttl=cache_config.get('stale_ttl', DEFAULT_STALE_TTL),
+                lease_seconds=cache_config.get('lease_seconds', DEFAULT_LEASE_SECONDS),
+            )
+        except sqlite3.Error as e:
+            print(f"Response cache disabled, unable to open it: {e}")
+            return None
+
+    def ttl_for(self, source):
+        return self.ttl.get(source, DEFAULT_TTL)
+
+    # Returns (value, state) where state is FRESH, STALE or MISS
+    def lookup(self, source, key):
+        value, state = self._lookup(source, key)
+        metrics.CACHE_LOOKUPS.inc(source=source, result=state)
+        return value, state
+
+    def _lookup(self, source, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, is_json, stored_at FROM entries WHERE source = ? AND key = ?',
+                (source, key),
+            ).fetchone()
+            if row is None:
+                return None, MISS
+            value, is_json, stored_at = row
+            age = now - stored_at
+            ttl = self.ttl_for(source)
+            if age > ttl + self.stale_ttl:
+                return None, MISS
+            self._db.execute(
+                'UPDATE entries SET accessed_at = ? WHERE source = ? AND key = ?',
+                (now, source, key),
+            )
+            self._db.commit()
+
+        value = json.loads(value) if is_json else bytes(value)
+        return value, FRESH if age <= ttl else STALE
+
+    # key -> (value, state) for each of `keys`
+    def lookup_many(self, source, keys):
+        return {key: self.lookup(source, key) for key in keys}
+
+    def store(self, source, key, value):
+        self.store_many(source, {key: value})
+
+    # Store `values` (key -> value) in one transaction
+    def store_many(self, source, values):
+        now = time.time()
+        rows = []
+        for key, value in values.items():
+            is_json = not isinstance(value, bytes)
+            blob = json.dumps(value).encode('utf-8') if is_json else value
+            rows.append((source, key, blob, int(is_json), len(blob), now, now))
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._evict()
+            self._db.commit()
+
+    # Bytes of database pages holding data, which the pragmas report without
+    # reading the table (and which include other processes' writes)
+    def _used_bytes(self):
+        pages = self._db.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = self._db.execute('PRAGMA freelist_count').fetchone()[0]
+        return (pages - free_pages) * self._page_size
+
+    def _evict(self):
+        used = self._used_bytes()
+        if used <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under 90% of the limit
+        target = used - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for source, key, size in self._db.execute('SELECT source, key, size FROM entries ORDER BY accessed_at'):
+            if freed >= target:
+                break
+            victims.append((source, key))
+            freed += size
+        self._db.executemany('DELETE FROM entries WHERE source = ? AND key = ?', victims)
+
+    # Lease `keys` of `source` for this process, returning the ones it got:
+    # keys another live process holds an unexpired lease on are left out.
+    # "lease_seconds": 0 turns leasing off, every key is granted.
+    def acquire(self, source, keys):
+        if not self.lease_seconds:
+            return list(keys)
+        now = time.time()
+        owner = os.getpid()
+        acquired = []
+        with self._lock:
+            self._db.execute('DELETE FROM leases WHERE expires_at < ?', (now,))
+            for key in keys:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO leases VALUES (?, ?, ?, ?)',
+                    (source, key, owner, now + self.lease_seconds),
+                )
+                if cursor.rowcount:
+                    acquired.append(key)
+            self._db.commit()
+        return acquired
+
+    def release(self, source, keys):
+        if not self.lease_seconds:
+            return
+        with self._lock:
+            self._db.executemany(
+                'DELETE FROM leases WHERE source = ? AND key = ? AND owner = ?',
+                [(source, key, os.getpid()) for key in keys],
+            )
+            self._db.commit()
+
+    # The `keys` of `source` another process still holds a lease on
+    def leased(self, source, keys):
+        if not self.lease_seconds:
+            return []
+        now = time.time()
+        leased = []
+        dead = set()
+        with self._lock:
+            for key in keys:
+                row = self._db.execute(
+                    'SELECT owner FROM leases WHERE source = ? AND key = ? AND expires_at >= ?',
+                    (source, key, now),
+                ).fetchone()
+                if row is None:
+                    continue
+                if row[0] in dead or not process_alive(row[0]):
+                    dead.add(row[0])
+                    continue
+                leased.append(key)
+            if dead:
+                # The process died mid-fetch (e.g. a gunicorn worker killed on timeout)
+                self._db.executemany('DELETE FROM leases WHERE owner = ?', [(owner,) for owner in dead])
+                self._db.commit()
+        return leased
+
+    # Refresh stale entries in the background. `refresh()` returns a dict of
+    # key -> value for the given keys; None values are not stored. Keys that
+    # already have a refresh in flight are skipped.
+    def revalidate(self, source, keys, refresh):
+        with self._refreshing_lock:
+            keys = [key for key in keys if (source, key) not in self._refreshing]
+            if not keys:
+                return
+            self._refreshing.update((source, key) for key in keys)
+
+        def job():
+            try:
+                self.store_many(source, {key: value for key, value in refresh(keys).items() if value is not None})
+            except Exception as e:
+                print(f"Error refreshing cached {source} entries: {e}")
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.difference_update((source, key) for key in keys)
+
+        self._refresh_pool.submit(job)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+
+import reports
+import roster
+from settings import stream_upstream
+
+# Batch export of a report for a large roster, written row by row as authors
+# complete:
+#
+#     python export.py report.xlsx
+#     python export.py report.parquet --roster faculty.csv --department Physics --source average
+#
+# Every finished author is also appended to a checkpoint file next to the
+# output, so rerunning the same command after a crash only fetches the
+# authors that were still missing (or had failed). The checkpoint is removed
+# once every author has been exported.
+
+# Report sources with one flat row per author
+EXPORT_SOURCES = ['both', 'average', 'googleScholarOnly']
+
+FORMATS = {'.csv': 'csv', '.xlsx': 'xlsx', '.parquet': 'parquet'}
+
+# Authors per unit of work, and how many units are fetched at once. Each unit
+# makes its batched Scopus searches and then streams its Scholar profiles.
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_WORKERS = 4
+
+# Rows buffered per Parquet row group
+PARQUET_ROW_GROUP = 1000
+
+
+def export_row(source, record):
+    return {'Scopus ID': record['id'], **reports.build_report_rows(source, [record])[0]}
+
+
+def export_columns(source):
+    return list(export_row(source, reports.make_record(('', '', ''), None, None)))
+
+
+class CsvSink:
+    def __init__(self, path, columns):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class XlsxSink:
+    """Write-only workbook: openpyxl streams rows to a temporary file instead of
+    keeping the sheet in memory, and assembles the .xlsx on close."""
+
+    def __init__(self, path, columns):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise SystemExit('XLSX export needs openpyxl (pip install openpyxl)')
+
+        self.path = path
+        self.columns = columns
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet('Report')
+        self._sheet.append(columns)
+
+    def write(self, row):
+        self._sheet.append([row[column] for column in self.columns])
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+class ParquetSink:
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit('Parquet export needs pyarrow (pip install pyarrow)')
+
+        self.columns = columns
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([
+            (column, pyarrow.string() if column in ('Scopus ID', 'Name', 'Yearly Citations') else pyarrow.int64())
+            for column in columns
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self._rows = []
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._writer.write_table(self._pyarrow.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+SINKS = {'csv': CsvSink, 'xlsx': XlsxSink, 'parquet': ParquetSink}
+
+
+class Checkpoint:
+    """Append-only JSON lines file of exported authors.
+
+    The first line records the report source; every other line is one author's
+    row and whether any of its upstream fetches failed. An author can appear
+    more than once (a failed fetch that was retried later), in which case the
+    last line wins.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self._file = None
+
+    # author_id -> failed, for every author in an existing checkpoint
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        done = {}
+        with open(self.path) as checkpoint_file:
+            header = checkpoint_file.readline()
+            if not header.endswith('\n'):
+                # Interrupted before the first author was written
+                return {}
+            header = json.loads(header)
+            if header.get('source') != self.source:
+                raise SystemExit(f"{self.path} is a checkpoint for the {header.get('source')!r} report; "
+                                 f"pass --restart to discard it")
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the crash
+                    continue
+                done[entry['id']] = entry['failed']
+        return done
+
+    # Rows of the authors exported successfully, read back from disk in order
+    def rows(self):
+        if not os.path.exists(self.path):
+            return
+        last_line = {}
+        with open(self.path) as checkpoint_file:
+            next(checkpoint_file, None)
+            for number, line in enumerate(checkpoint_file):
+                try:
+                    last_line[json.loads(line)['id']] = number
+                except ValueError:
+                    continue
+        with open(self.path) as checkpoint_file:
+            next(checkpoint_file, None)
+            for number, line in enumerate(checkpoint_file):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if last_line[entry['id']] == number and not entry['failed']:
+                    yield entry['row']
+
+    def open(self):
+        if not os.path.exists(self.path) or not self.load():
+            with open(self.path, 'w') as checkpoint_file:
+                checkpoint_file.write(json.dumps({'source': self.source}) + '\n')
+        else:
+            with open(self.path, 'rb') as checkpoint_file:
+                checkpoint_file.seek(-1, os.SEEK_END)
+                partial = checkpoint_file.read(1) != b'\n'
+            if partial:
+                # End the line cut short by the crash so it is skipped on load
+                with open(self.path, 'a') as checkpoint_file:
+                    checkpoint_file.write('\n')
+        self._file = open(self.path, 'a')
+
+    def add(self, author_id, row, failed):
+        self._file.write(json.dumps({'id': author_id, 'row': row, 'failed': failed}) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def remove(self):
+        os.remove(self.path)
+
+
+# Stream the records of `authors`, `chunk_size` at a time with `workers`
+# chunks in flight, to `emit`
+async def stream_export_records(engine, emit, authors, upstreams, chunk_size, workers):
+    chunks = [authors[start:start + chunk_size] for start in range(0, len(authors), chunk_size)]
+
+    async def worker():
+        while chunks:
+            await reports.stream_author_records(engine, emit, chunks.pop(0), upstreams)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+def record_failed(record, upstreams):
+    return any(record[upstream] is None for upstream in upstreams)
+
+
+def export(authors, output, file_format, source, checkpoint_path, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS):
+    started = time.time()
+    upstreams = reports.REPORT_SOURCES[source]
+    checkpoint = Checkpoint(checkpoint_path, source)
+    done = checkpoint.load()
+    # Authors not exported yet, or whose fetch failed last time
+    pending = [author for author in authors if author[0] not in done or done[author[0]]]
+    if done:
+        print(f"Resuming from {checkpoint_path}: {len(authors) - len(pending)} of {len(authors)} authors already exported")
+
+    sink = SINKS[file_format](output, export_columns(source))
+    exported = failed = 0
+    try:
+        # The output is rewritten on every run: rows from the checkpoint first,
+        # then the rest as each author completes
+        for row in checkpoint.rows():
+            sink.write(row)
+            exported += 1
+
+        checkpoint.open()
+        for record in stream_upstream(stream_export_records, pending, upstreams, chunk_size, workers):
+            row = export_row(source, record)
+            record_is_failed = record_failed(record, upstreams)
+            checkpoint.add(record['id'], row, record_is_failed)
+            sink.write(row)
+            exported += 1
+            failed += record_is_failed
+            if exported % 100 == 0:
+                print(f"Exported {exported} of {len(authors)} authors ({time.time() - started:.0f}s)", flush=True)
+    finally:
+        checkpoint.close()
+        sink.close()
+
+    print(f"Exported {exported} authors to {output} in {time.time() - started:.1f}s")
+    if exported < len(authors) or failed:
+        print(f"{len(authors) - exported + failed} authors are missing or incomplete; "
+              f"run the same command again to retry them")
+    else:
+        checkpoint.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a report for a roster to XLSX, CSV or Parquet.')
+    parser.add_argument('output', help='output file; the format follows the extension unless --format is given')
+    parser.add_argument('--format', choices=sorted(SINKS), help='output format')
+    parser.add_argument('--roster', help='roster file to export instead of the configured roster (see roster.py)')
+    parser.add_argument('--department', action='append', help='only export this department (repeatable)')
+    parser.add_argument('--source', choices=EXPORT_SOURCES, default='both', help='report to export')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <output>.checkpoint.jsonl)')
+    parser.add_argument('--restart', action='store_true', help='discard an existing checkpoint and start over')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='authors per unit of work')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='units of work fetched at once')
+    args = parser.parse_args()
+
+    file_format = args.format or FORMATS.get(os.path.splitext(args.output)[1].lower())
+    if file_format is None:
+        parser.error('unknown output format; use a .csv, .xlsx or .parquet file or pass --format')
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint.jsonl'
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    authors = roster.Roster(roster.read_roster(args.roster)) if args.roster else reports.get_roster()
+    export(authors.select(args.department), args.output, file_format, args.source, checkpoint_path,
+           max(1, args.chunk_size), max(1, args.workers))
+
+
+if __name__ == "__main__":
+    main()
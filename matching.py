@@ -0,0 +1,240 @@
+import math
+import re
+import unicodedata
+
+import scopus
+
+# Matching Scopus papers to Google Scholar papers of the same author. Pairs are
+# found in three passes, each over the papers the previous ones left:
+#
+# 1. DOI, when both papers have one (Scopus gives prism:doi; Scholar profile
+#    rows do not, so this mostly pays off for other sources of paper lists)
+# 2. Exact normalized title, with compatible years
+# 3. Fuzzy title: Jaccard similarity of the titles' character n-grams, with
+#    compatible years. Candidates come from an inverted index over the rarest
+#    n-grams of each title (prefix filtering): two n-gram sets with Jaccard
+#    similarity >= t must share one of their first len - ceil(t * len) + 1
+#    n-grams in a common rarity order, so only titles sharing one of those are
+#    ever compared, instead of every Scopus title against every Scholar one.
+
+# Characters per n-gram for fuzzy title matching
+NGRAM = 3
+
+# Minimum Jaccard similarity of two titles' n-grams for a fuzzy match
+DEFAULT_THRESHOLD = 0.7
+
+# Publication years this far apart still match (online first vs. issue year)
+YEAR_TOLERANCE = 1
+
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_title(title):
+    text = str(title or '')
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return NON_WORD.sub(' ', text.casefold()).strip()
+
+
+def normalize_doi(doi):
+    doi = str(doi or '')
+    if '10.' not in doi:
+        return None
+    doi = doi.strip().casefold()
+    for prefix in ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/', 'doi:'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi if doi.startswith('10.') else None
+
+
+# The DOI of a paper: "doi" if it has one, else its link when that is a DOI
+# (parse_scopus_paper keeps prism:doi as the link)
+def paper_doi(paper):
+    return normalize_doi(paper.get('doi')) or normalize_doi(paper.get('link'))
+
+
+def paper_year(paper):
+    year = str(paper.get('year') or '')[:4]
+    return int(year) if year.isdigit() else None
+
+
+def years_match(year, other_year):
+    return year is None or other_year is None or abs(year - other_year) <= YEAR_TOLERANCE
+
+
+def title_ngrams(title):
+    padded = f' {title} '
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+def jaccard(ngrams, other_ngrams):
+    shared = len(ngrams & other_ngrams)
+    return shared / (len(ngrams) + len(other_ngrams) - shared)
+
+
+class PaperKeys:
+    """What the matching passes look at for each paper of one list, computed
+    once: DOI, normalized title and year, and the title n-grams of the papers
+    that get as far as fuzzy matching."""
+
+    def __init__(self, papers):
+        self.dois = [paper_doi(paper) for paper in papers]
+        self.titles = [normalize_title(paper.get('title')) for paper in papers]
+        self.years = [paper_year(paper) for paper in papers]
+        self._ngrams = {}
+
+    def ngrams(self, index):
+        ngrams = self._ngrams.get(index)
+        if ngrams is None:
+            ngrams = self._ngrams[index] = title_ngrams(self.titles[index]) if self.titles[index] else set()
+        return ngrams
+
+
+# Pairs of (scopus_index, scholar_index, method) for the papers in the two
+# lists that are the same publication, method being "doi", "title" or "fuzzy".
+# Every paper is in at most one pair.
+def match_papers(scopus_papers, scholar_papers, threshold=DEFAULT_THRESHOLD):
+    scopus_keys = PaperKeys(scopus_papers)
+    scholar_keys = PaperKeys(scholar_papers)
+    scopus_left = set(range(len(scopus_papers)))
+    scholar_left = set(range(len(scholar_papers)))
+    pairs = []
+
+    def pair(scopus_index, scholar_index, method):
+        scopus_left.discard(scopus_index)
+        scholar_left.discard(scholar_index)
+        pairs.append((scopus_index, scholar_index, method))
+
+    # DOI
+    by_doi = {}
+    for index in sorted(scopus_left):
+        if scopus_keys.dois[index]:
+            by_doi.setdefault(scopus_keys.dois[index], index)
+    for index in sorted(scholar_left):
+        match = by_doi.pop(scholar_keys.dois[index], None) if scholar_keys.dois[index] else None
+        if match is not None:
+            pair(match, index, 'doi')
+
+    # Exact normalized title
+    by_title = {}
+    for index in sorted(scopus_left):
+        if scopus_keys.titles[index]:
+            by_title.setdefault(scopus_keys.titles[index], []).append(index)
+    for index in sorted(scholar_left):
+        candidates = by_title.get(scholar_keys.titles[index], [])
+        for position, candidate in enumerate(candidates):
+            if years_match(scopus_keys.years[candidate], scholar_keys.years[index]):
+                pair(candidates.pop(position), index, 'title')
+                break
+
+    # Fuzzy title, best scoring pairs first
+    for score, scopus_index, scholar_index in fuzzy_candidates(scopus_keys, scopus_left, scholar_keys, scholar_left, threshold):
+        if scopus_index in scopus_left and scholar_index in scholar_left:
+            pair(scopus_index, scholar_index, 'fuzzy')
+    return pairs
+
+
+# (score, scopus_index, scholar_index) for every pair of the remaining papers
+# whose titles are at least `threshold` similar and whose years match,
+# highest score first
+def fuzzy_candidates(scopus_keys, scopus_left, scholar_keys, scholar_left, threshold):
+    scopus_left = [index for index in sorted(scopus_left) if scopus_keys.titles[index]]
+    scholar_left = [index for index in sorted(scholar_left) if scholar_keys.titles[index]]
+    if not scopus_left or not scholar_left:
+        return []
+
+    # Number every n-gram by rarity across both lists (frequency in the high
+    # bits, order of first appearance in the low ones), so a title's prefix
+    # is its smallest numbers and ranking a title is a plain sort of ints
+    frequency = {}
+    for keys, indexes in ((scopus_keys, scopus_left), (scholar_keys, scholar_left)):
+        for index in indexes:
+            for ngram in keys.ngrams(index):
+                frequency[ngram] = frequency.get(ngram, 0) + 1
+    rarity = {ngram: (count << 32) | number for number, (ngram, count) in enumerate(frequency.items())}
+
+    def ranked(ngrams):
+        return sorted(map(rarity.__getitem__, ngrams))
+
+    def prefix_length(size):
+        return size - math.ceil(threshold * size) + 1
+
+    # Prefix n-gram -> (scopus_index, position in its ranked n-grams)
+    index = {}
+    scopus_sizes = {}
+    for scopus_index in scopus_left:
+        ngrams = ranked(scopus_keys.ngrams(scopus_index))
+        scopus_sizes[scopus_index] = len(ngrams)
+        for position in range(prefix_length(len(ngrams))):
+            index.setdefault(ngrams[position], []).append((scopus_index, position))
+
+    matches = []
+    for scholar_index in scholar_left:
+        ngrams = scholar_keys.ngrams(scholar_index)
+        size = len(ngrams)
+        year = scholar_keys.years[scholar_index]
+        # Shortest and longest titles (in n-grams) that can still be similar enough
+        smallest, largest = threshold * size, size / threshold
+        seen = set()
+        for position, ngram in enumerate(ranked(ngrams)[:prefix_length(size)]):
+            for scopus_index, other_position in index.get(ngram, ()):
+                if scopus_index in seen:
+                    continue
+                other_size = scopus_sizes[scopus_index]
+                if not smallest <= other_size <= largest:
+                    continue
+                # Positional filter: n-grams after these positions are all the
+                # overlap there can be, and Jaccard >= t needs an overlap of
+                # at least t / (1 + t) * (|x| + |y|)
+                if 1 + min(size - position - 1, other_size - other_position - 1) < threshold / (1 + threshold) * (size + other_size):
+                    continue
+                seen.add(scopus_index)
+                if not years_match(scopus_keys.years[scopus_index], year):
+                    continue
+                score = jaccard(ngrams, scopus_keys.ngrams(scopus_index))
+                if score >= threshold:
+                    matches.append((score, scopus_index, scholar_index))
+    matches.sort(key=lambda match: (-match[0], match[1], match[2]))
+    return matches
+
+
+# One author's papers from both upstreams as a single list: matched papers
+# once, with both citation counts, followed by the papers only one upstream
+# has. "citations" is the higher of the two counts, so summing it gives a
+# deduplicated citation total.
+def merge_papers(scopus_papers, scholar_papers, threshold=DEFAULT_THRESHOLD):
+    pairs = match_papers(scopus_papers, scholar_papers, threshold)
+    matched_scopus = {scopus_index for scopus_index, _, _ in pairs}
+    matched_scholar = {scholar_index for _, scholar_index, _ in pairs}
+
+    def merged(scopus_paper, scholar_paper, match):
+        paper = scopus_paper or scholar_paper
+        scopus_citations = scopus.citation_count(scopus_paper) if scopus_paper else None
+        scholar_citations = scopus.citation_count(scholar_paper) if scholar_paper else None
+        return {
+            'title': paper.get('title'),
+            # Scopus' year, unless only Scholar has a readable one
+            'year': scholar_paper.get('year') if scholar_paper and not paper_year(paper) else paper.get('year'),
+            'doi': paper_doi(scopus_paper or {}) or paper_doi(scholar_paper or {}),
+            'scopus_citations': scopus_citations,
+            'scholar_citations': scholar_citations,
+            'citations': max(count for count in (scopus_citations, scholar_citations) if count is not None),
+            'scholar_link': scholar_paper.get('link') if scholar_paper else None,
+            'sources': [source for source, found in (('scopus', scopus_paper), ('scholar', scholar_paper)) if found],
+            'match': match,
+        }
+
+    papers = [merged(scopus_papers[scopus_index], scholar_papers[scholar_index], match) for scopus_index, scholar_index, match in pairs]
+    papers += [merged(paper, None, None) for index, paper in enumerate(scopus_papers) if index not in matched_scopus]
+    papers += [merged(None, paper, None) for index, paper in enumerate(scholar_papers) if index not in matched_scholar]
+    return papers
+
+
+# Overlap figures for a merged paper list
+def merged_summary(papers):
+    return {
+        'matched': sum(len(paper['sources']) == 2 for paper in papers),
+        'scopus_only': sum(paper['sources'] == ['scopus'] for paper in papers),
+        'scholar_only': sum(paper['sources'] == ['scholar'] for paper in papers),
+        'citations': sum(paper['citations'] for paper in papers),
+    }
@@ -0,0 +1,169 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics, rendered in the Prometheus text format by /metrics.
+# Each gunicorn worker keeps its own counters, so scrape every worker (or sum
+# over the instance label) for deployment-wide figures.
+
+# Latency buckets in seconds, from a cache hit up to a full live report
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Timed operations slower than this are also printed as a JSON line with all
+# their tags (source mode, author, host, ...)
+DEFAULT_SLOW_SECONDS = 5.0
+
+_slow_seconds = DEFAULT_SLOW_SECONDS
+_metrics = []
+
+# Tags of the unit of work in progress, e.g. {"source": "both", "author": "5722..."}.
+# Context variables follow asyncio tasks, so each author's fetch can carry its
+# own tags; upstream.Client copies them over to its event loop thread.
+_tags = contextvars.ContextVar('metrics_tags', default={})
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(zip(self.labelnames, key))} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                labels = list(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(labels + [("le", format_value(float(bound)))])} {count}')
+                lines.append(f'{self.name}_bucket{format_labels(labels + [("le", "+Inf")])} {counts[-2]}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(counts[-1])}')
+                lines.append(f'{self.name}_count{format_labels(labels)} {counts[-2]}')
+        return lines
+
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    'gsc_sco_upstream_request_seconds', 'Time for one upstream HTTP request attempt.', ['host', 'status'])
+UPSTREAM_RESPONSE_BYTES = Counter(
+    'gsc_sco_upstream_response_bytes_total', 'Response body bytes received from upstream.', ['host'])
+UPSTREAM_REQUEST_BYTES = Counter(
+    'gsc_sco_upstream_request_bytes_total', 'Request line and header bytes sent upstream.', ['host'])
+UPSTREAM_RETRIES = Counter(
+    'gsc_sco_upstream_retries_total', 'Upstream requests retried, by the status that caused it.', ['host', 'reason'])
+UPSTREAM_REFUSED = Counter(
+    'gsc_sco_upstream_refused_total', 'Upstream requests not made because the host circuit was open.', ['host'])
+UPSTREAM_CAPTCHAS = Counter(
+    'gsc_sco_upstream_captchas_total', 'CAPTCHA pages served by upstream.', ['host'])
+COALESCED = Counter(
+    'gsc_sco_coalesced_total', 'Fetches and report builds shared with a concurrent caller, by scope (process, worker or report).', ['source', 'scope'])
+CACHE_LOOKUPS = Counter(
+    'gsc_sco_cache_lookups_total', 'Response cache lookups by result (fresh, stale or miss).', ['source', 'result'])
+PARSE_SECONDS = Histogram(
+    'gsc_sco_parse_seconds', 'Time spent parsing upstream responses.', ['parser'])
+REPORT_BUILD_SECONDS = Histogram(
+    'gsc_sco_report_build_seconds', 'Time spent assembling report rows from author records.', ['source'])
+REPORT_SECONDS = Histogram(
+    'gsc_sco_report_seconds', 'Time to serve a report request end to end.', ['endpoint', 'source', 'served_from'])
+REPORT_RESPONSE_BYTES = Counter(
+    'gsc_sco_report_response_bytes_total', 'Report bytes sent to clients.', ['endpoint', 'source'])
+
+
+def configure(metrics_config=None):
+    global _slow_seconds
+    _slow_seconds = (metrics_config or {}).get('slow_seconds', DEFAULT_SLOW_SECONDS)
+
+
+def current_tags():
+    return _tags.get()
+
+
+# Add tags to the current task (or thread) for the rest of its run
+def tag(**tags):
+    _tags.set({**_tags.get(), **tags})
+
+
+@contextmanager
+def tagged(**tags):
+    token = _tags.set({**_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def observe(histogram, seconds, **labels):
+    histogram.observe(seconds, **labels)
+    if seconds >= _slow_seconds:
+        print(json.dumps({'slow': histogram.name, 'seconds': round(seconds, 3), **current_tags(), **labels}))
+
+
+# Time the body of the with-block into `histogram`. Labels can be added to the
+# yielded dict before the block ends (e.g. a status only known afterwards).
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(histogram, time.perf_counter() - started, **labels)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import copy
+import functools
+import json
+import os
+import random
+import re
+import string
+import zlib
+
+from aiohttp import web
+
+# Local stand-in for the Scopus Search API and Scholar profile pages. It
+# replays the response fixtures in fixtures/ with per-author data generated
+# deterministically from the author ID, so any roster (including the real one
+# and the synthetic ones from synthetic_roster) gets stable, realistic pages.
+# Point the app at it with "UPSTREAM_URLS" in config.json; benchmark.py starts
+# one itself.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+DEFAULT_PORT = 8765
+
+# Scholar profile pages list 20 papers unless asked for more with
+# cstart/pagesize; pagesize tops out at 100
+SCHOLAR_PAGE_SIZE = 20
+SCHOLAR_MAX_PAGE_SIZE = 100
+
+# Largest count the Search API accepts (in the STANDARD and COMPLETE views),
+# and the start offset it stops at
+SCOPUS_MAX_COUNT = 200
+SCOPUS_COMPLETE_MAX_COUNT = 25
+SCOPUS_START_LIMIT = 5000
+
+DEFAULT_MAX_PAPERS = 200
+FIRST_YEAR = 2005
+LAST_YEAR = 2024
+
+WORDS = ['adaptive', 'analysis', 'approach', 'attention', 'based', 'classification', 'cloud', 'clustering',
+         'data', 'deep', 'detection', 'efficient', 'ensemble', 'framework', 'fuzzy', 'graph', 'hybrid',
+         'image', 'learning', 'model', 'multi-modal', 'network', 'neural', 'novel', 'optimization',
+         'prediction', 'recognition', 'retrieval', 'secure', 'segmentation', 'sentiment', 'survey', 'system',
+         'text', 'transformer', 'using', 'wireless']
+VENUES = ['Procedia Computer Science', 'IEEE Access', 'Multimedia Tools and Applications',
+          'Lecture Notes in Networks and Systems', 'International Journal of Information Technology']
+SURNAMES = ['Rao', 'Joseph', 'Kumar', 'Nair', 'Thomas', 'Menon', 'Paul', 'Reddy', 'Iyer', 'George']
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as fixture:
+        return fixture.read()
+
+
+SCOPUS_ENTRY = json.loads(load_fixture('scopus_entry.json'))
+SCHOLAR_PROFILE = string.Template(load_fixture('scholar_profile.html'))
+SCHOLAR_ROW = string.Template(load_fixture('scholar_row.html').strip())
+SCHOLAR_CAPTCHA = load_fixture('scholar_captcha.html').encode('utf-8')
+SCHOLAR_NO_ARTICLES = '<tr class="gsc_a_e"><td class="gsc_a_e" colspan="3">There are no articles in this profile.</td></tr>'
+
+
+# Synthetic roster of `size` authors in the (scopus_id, name, scholar_link)
+# shape of reports.AUTHOR_IDS
+def synthetic_roster(size):
+    return [
+        (str(90000000000 + i), f"Dr MOCK AUTHOR {i}", f"https://scholar.google.com/citations?user=MOCK{i:06d}AAAJ&hl=en")
+        for i in range(size)
+    ]
+
+
+def author_rng(key):
+    return random.Random(zlib.crc32(key.encode('utf-8')))
+
+
+def h_index(citations):
+    citations = sorted(citations, reverse=True)
+    return sum(c >= i + 1 for i, c in enumerate(citations))
+
+
+# The papers an author "has": title, year and citation count, the same on
+# every call for the same key (Scopus author ID or Scholar user)
+@functools.lru_cache(maxsize=20000)
+def author_papers(key, max_papers):
+    rng = author_rng(key)
+    papers = []
+    for i in range(rng.randint(1, max_papers)):
+        year = rng.randint(FIRST_YEAR, LAST_YEAR)
+        papers.append({
+            'title': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 12))).capitalize(),
+            'year': year,
+            # Date the record was added to Scopus, as YYYYMMDD
+            'loaded': f'{year + 1}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}',
+            'citations': int(rng.paretovariate(1.2)) - 1 + rng.randint(0, 3) * (LAST_YEAR - year),
+            'venue': rng.choice(VENUES),
+            'coauthors': [f"{rng.choice('ABCDEFGHKMPRS')} {rng.choice(SURNAMES)}" for _ in range(rng.randint(1, 5))],
+            'key': f'{rng.getrandbits(48):012x}',
+        })
+    return papers
+
+
+def scopus_entry(author_id, index, paper, fields, complete):
+    scopus_id = str(85000000000 + zlib.crc32(f'{author_id}:{index}'.encode()) % 999999999)
+    entry = copy.deepcopy(SCOPUS_ENTRY)
+    entry.update({
+        'prism:url': f'https://api.elsevier.com/content/abstract/scopus_id/{scopus_id}',
+        'dc:identifier': f'SCOPUS_ID:{scopus_id}',
+        'eid': f'2-s2.0-{scopus_id}',
+        'dc:title': paper['title'],
+        'prism:publicationName': paper['venue'],
+        'prism:coverDate': f"{paper['year']}-01-01",
+        'prism:coverDisplayDate': str(paper['year']),
+        'prism:doi': f"10.5555/mock.{author_id}.{index}",
+        'citedby-count': str(paper['citations']),
+    })
+    entry['author'][0]['authid'] = author_id
+    if complete:
+        entry['author-count']['$'] = entry['author-count']['@total'] = str(len(entry['author']))
+    else:
+        # The author list is only served in the COMPLETE view
+        del entry['author']
+    if fields:
+        entry = {key: value for key, value in entry.items() if key in fields or key == '@_fa'}
+    return entry
+
+
+# A Scholar profile page for `user`, listing papers cstart..cstart+pagesize,
+# most cited first or sorted by `sortby` ("pubdate" or "title")
+def scholar_profile_page(user, cstart=0, pagesize=SCHOLAR_PAGE_SIZE, max_papers=DEFAULT_MAX_PAPERS, sortby=None):
+    papers = author_papers(user, max_papers)
+    if sortby == 'pubdate':
+        listed = sorted(papers, key=lambda paper: paper['year'], reverse=True)
+    elif sortby == 'title':
+        listed = sorted(papers, key=lambda paper: paper['title'])
+    else:
+        listed = sorted(papers, key=lambda paper: paper['citations'], reverse=True)
+    page = listed[cstart:cstart + min(pagesize, SCHOLAR_MAX_PAGE_SIZE)]
+
+    since = LAST_YEAR - 5
+    citations = [paper['citations'] for paper in papers]
+    recent = [paper['citations'] for paper in papers if paper['year'] >= since]
+    years = range(max(FIRST_YEAR, LAST_YEAR - 7), LAST_YEAR + 1)
+    rng = author_rng(user)
+    histogram = ''.join(f'<span class="gsc_g_t" style="right:{(LAST_YEAR - year) * 32 + 17}px">{year}</span>' for year in years)
+    histogram += ''.join(
+        f'<a href="javascript:void(0)" class="gsc_g_a" style="right:{(LAST_YEAR - year) * 32 + 10}px;height:{rng.randint(1, 90)}px;z-index:{year - FIRST_YEAR}">'
+        f'<span class="gsc_g_al">{rng.randint(0, max(1, sum(citations) // 10))}</span></a>'
+        for year in years
+    )
+    rows = ''.join(
+        SCHOLAR_ROW.substitute(
+            user=user,
+            paper_key=paper['key'],
+            title=paper['title'],
+            authors=', '.join(paper['coauthors']),
+            venue=paper['venue'],
+            year=paper['year'],
+            cites_id=int(paper['key'], 16),
+            citations=paper['citations'] or '',
+        )
+        for paper in page
+    )
+
+    return SCHOLAR_PROFILE.substitute(
+        name=f'Mock Author {user}',
+        affiliation='Christ University',
+        user=user,
+        since=since,
+        citations=sum(citations),
+        citations_recent=sum(recent),
+        h_index=h_index(citations),
+        h_index_recent=h_index(recent),
+        i10_index=sum(c >= 10 for c in citations),
+        i10_index_recent=sum(c >= 10 for c in recent),
+        histogram=histogram,
+        rows=rows or SCHOLAR_NO_ARTICLES,
+        more_disabled='' if cstart + len(page) < len(papers) else ' disabled',
+    ).encode('utf-8')
+
+
+class MockUpstream:
+    def __init__(self, scopus_latency=0.05, scholar_latency=0.1, jitter=0.5, error_rate=0.0,
+                 throttle_rate=0.0, captcha_rate=0.0, max_papers=DEFAULT_MAX_PAPERS, seed=None):
+        self.scopus_latency = scopus_latency
+        self.scholar_latency = scholar_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.captcha_rate = captcha_rate
+        self.max_papers = max_papers
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.stats = {
+            'requests': {'scopus': 0, 'scholar': 0},
+            'bytes': {'scopus': 0, 'scholar': 0},
+            'errors': 0,
+            'throttled': 0,
+            'captchas': 0,
+        }
+
+    async def delay(self, latency):
+        if latency > 0:
+            await asyncio.sleep(latency * self.random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    # Injected 5xx and 429 responses, or None to answer normally
+    def injected_error(self):
+        roll = self.random.random()
+        if roll < self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+        if roll < self.error_rate + self.throttle_rate:
+            self.stats['throttled'] += 1
+            return web.Response(status=429, text='Too Many Requests', headers={'Retry-After': '1'})
+        return None
+
+    def respond(self, upstream, body, content_type):
+        self.stats['bytes'][upstream] += len(body)
+        return web.Response(body=body, content_type=content_type, charset='utf-8')
+
+    async def scopus_search(self, request):
+        self.stats['requests']['scopus'] += 1
+        await self.delay(self.scopus_latency)
+        error = self.injected_error()
+        if error is not None:
+            return error
+
+        params = request.query
+        if not request.headers.get('X-ELS-APIKey'):
+            return web.json_response({'service-error': {'status': {'statusCode': 'AUTHENTICATION_ERROR'}}}, status=401)
+
+        author_ids = re.findall(r'AU-ID\((\d+)\)', params.get('query', ''))
+        fields = set(params['field'].split(',')) if params.get('field') else None
+        complete = params.get('view', '').upper() == 'COMPLETE'
+        count = min(int(params.get('count', 25)), SCOPUS_COMPLETE_MAX_COUNT if complete else SCOPUS_MAX_COUNT)
+
+        cursor = params.get('cursor')
+        if cursor is not None:
+            start = 0 if cursor == '*' else int(cursor)
+        else:
+            start = int(params.get('start', 0))
+            if start + count > SCOPUS_START_LIMIT:
+                return web.json_response({'service-error': {'status': {
+                    'statusCode': 'INVALID_INPUT', 'statusText': 'Exceeds the maximum number allowed for the service level'}}},
+                    status=400)
+
+        # Date-bounded queries, e.g. "(AU-ID(1) OR AU-ID(2)) AND ORIG-LOAD-DATE AFT 20240101"
+        loaded_after = re.search(r'ORIG-LOAD-DATE AFT (\d{8})', params.get('query', ''))
+        results = [(author_id, index, paper) for author_id in author_ids
+                   for index, paper in enumerate(author_papers(author_id, self.max_papers))
+                   if loaded_after is None or paper['loaded'] > loaded_after.group(1)]
+        entries = [scopus_entry(author_id, index, paper, fields, complete)
+                   for author_id, index, paper in results[start:start + count]]
+        search_results = {
+            'opensearch:totalResults': str(len(results)),
+            'opensearch:startIndex': str(start),
+            'opensearch:itemsPerPage': str(len(entries)),
+            'opensearch:Query': {'@role': 'request', '@searchTerms': params.get('query', ''), '@startPage': str(start)},
+            'entry': entries or [{'@_fa': 'true', 'error': 'Result set was empty'}],
+        }
+        if cursor is not None:
+            search_results['cursor'] = {'@current': cursor, '@next': str(start + len(entries))}
+
+        body = json.dumps({'search-results': search_results}).encode('utf-8')
+        return self.respond('scopus', body, 'application/json')
+
+    async def scholar_profile(self, request):
+        self.stats['requests']['scholar'] += 1
+        await self.delay(self.scholar_latency)
+        error = self.injected_error()
+        if error is not None:
+            return error
+        if self.random.random() < self.captcha_rate:
+            self.stats['captchas'] += 1
+            return self.respond('scholar', SCHOLAR_CAPTCHA, 'text/html')
+
+        user = request.query.get('user', '')
+        cstart = int(request.query.get('cstart', 0))
+        pagesize = int(request.query.get('pagesize', SCHOLAR_PAGE_SIZE))
+        body = scholar_profile_page(user, cstart, pagesize, self.max_papers, request.query.get('sortby'))
+        return self.respond('scholar', body, 'text/html')
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def reset_stats(self, request):
+        self.reset()
+        return web.json_response(self.stats)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/content/search/scopus', self.scopus_search)
+        app.router.add_get('/citations', self.scholar_profile)
+        app.router.add_get('/_mock/stats', self.get_stats)
+        app.router.add_post('/_mock/reset', self.reset_stats)
+        return app
+
+
+def add_arguments(parser):
+    parser.add_argument('--scopus-latency', type=float, default=0.05, help='seconds per Scopus response')
+    parser.add_argument('--scholar-latency', type=float, default=0.1, help='seconds per Scholar response')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency varies by +/- this fraction')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='fraction of Scholar requests answered with a CAPTCHA page')
+    parser.add_argument('--max-papers', type=int, default=DEFAULT_MAX_PAPERS, help='most papers a generated author has')
+    parser.add_argument('--seed', type=int, help='seed for the latency and error injection')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve mock Scopus and Google Scholar responses.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = MockUpstream(args.scopus_latency, args.scholar_latency, args.jitter, args.error_rate,
+                        args.throttle_rate, args.captcha_rate, args.max_papers, args.seed)
+    print(f"Mock upstream listening on http://{args.host}:{args.port}", flush=True)
+    web.run_app(mock.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
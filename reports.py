@@ -0,0 +1,492 @@
+import asyncio
+import threading
+import time
+
+import matching
+import metrics
+import roster
+import scholar
+import scopus
+import sync
+import upstream
+from settings import API_KEY, SCOPUS_BATCH_SIZE, SCOPUS_PAGE_SIZE, config, run_upstream, sync_store
+
+# List of authors with Scopus IDs and Google Scholar links
+AUTHOR_IDS = [
+    ("57223100630", "Dr AMRUTHA", "https://scholar.google.com/citations?user=fzs9d1IAAAAJ&hl=en"),
+    ("55079543700", "Dr ANITA H B", "https://scholar.google.com/citations?user=-ZYIiGAAAAAJ&hl=en"),
+    ("35737586100", "Dr AROKIA PAUL RAJAN R", "https://scholar.google.com/citations?hl=en&user=5Dl7tEYAAAAJ"),
+    ("57189239708", "Dr ASHOK IMMANUEL V", "https://scholar.google.co.in/citations?user=px8Z3Q4AAAAJ&hl=en"),
+    ("55881946700", "Dr BEAULAH SOUNDARABAI P", "https://scholar.google.co.in/citations?user=jTCHV4kAAAAJ&hl=en"),
+    ("57044254900", "Dr CECIL DONALD A", "https://scholar.google.co.in/citations?user=_bbxYHsAAAAJ&hl=en&authuser=1"),
+    ("57055221400", "Dr CHANDRA J", "https://scholar.google.com/citations?user=bn6WQUoAAAAJ"),
+    ("59256484700", "Dr CYNTHIA T", "https://scholar.google.com/citations?hl=en&user=ThELNO0AAAAJ"),
+    ("57162822500", "Dr DEEPA V JOSE", "https://scholar.google.co.in/citations?user=ryhyx4IAAAAJ&hl=en"),
+    ("57205027677", "FABIOLA HAZEL POHRMEN", "https://scholar.google.com/citations?user=prcv4fAAAAAJ&hl=en&oi=ao")
+]
+
+# The roster reports cover: the file or SQLite table under "ROSTER" in
+# config.json, or AUTHOR_IDS above; see roster.py. It is read on first use by
+# get_roster() rather than when a worker starts; assign a Roster to use
+# another one.
+ROSTER = None
+roster_lock = threading.Lock()
+
+
+def get_roster():
+    global ROSTER
+    with roster_lock:
+        if ROSTER is None:
+            ROSTER = roster.Roster.from_config(config.get('ROSTER'), AUTHOR_IDS)
+        return ROSTER
+
+
+# Report sources accepted by /generate_report and the upstreams each one needs
+REPORT_SOURCES = {
+    'both': ('scopus', 'scholar'),
+    'average': ('scopus', 'scholar'),
+    'googleScholarOnly': ('scholar',),
+    'paperDetails': ('scholar',),
+    'paperDetailsScopus': ('scopus',),
+    'aggregate': ('scopus', 'scholar'),
+    'paperDetailsMerged': ('scopus', 'scholar'),
+}
+
+ALL_UPSTREAMS = ('scopus', 'scholar')
+
+# Sort keys /generate_report accepts and the author row column each sorts on.
+# The unprefixed keys sort on Google Scholar, except for the Scopus-only report.
+SORT_COLUMNS = {
+    'name': 'Name',
+    'scholar_papers': 'Total Papers (Google Scholar)',
+    'scholar_citations': 'Total Citations (Google Scholar)',
+    'scholar_h_index': 'H-Index (Google Scholar)',
+    'i10_index': 'I10 Index (Google Scholar)',
+    'scopus_papers': 'Total Papers (Scopus)',
+    'scopus_citations': 'Total Citations (Scopus)',
+    'scopus_h_index': 'H-Index (Scopus)',
+}
+
+
+# Build an author's record. Each record keeps the Scopus and Scholar parts
+# separately with the time they were refreshed. When an upstream fetch failed
+# (None), that part is carried over from the author's previous record if
+# there is one.
+def make_record(author, scopus_part, scholar_part, previous=None):
+    author_id, author_name, gscholar_link = author
+    old = previous or {}
+    return {
+        'id': author_id,
+        'name': author_name,
+        'link': gscholar_link,
+        'scopus': scopus_part if scopus_part is not None else old.get('scopus'),
+        'scholar': scholar_part if scholar_part is not None else old.get('scholar'),
+    }
+
+
+# A record part is refreshed when its data was fetched from the upstream, which
+# for a cached response is when it went into the cache
+def make_scopus_part(scopus_response_json):
+    if scopus_response_json is None:
+        return None
+    with metrics.timed(metrics.PARSE_SECONDS, parser='scopus_entries'):
+        return {
+            'summary': scopus.parse_scopus_data(scopus_response_json),
+            'papers': scopus.parse_scopus_papers(scopus_response_json),
+            'refreshed_at': scopus_response_json.get('fetched_at', time.time()),
+        }
+
+
+# author_id -> Scopus record part (None where the fetch failed). With
+# incremental sync on, only what changed since the last sync is fetched.
+async def fetch_scopus_parts(engine, author_ids, upstreams):
+    if 'scopus' not in upstreams:
+        return {}
+    ids = [author_id for author_id, _, _ in author_ids]
+    if sync_store is not None:
+        # Authors another request is already syncing are waited for, not synced twice
+        return await upstream.single_flight_many(engine, 'scopus_sync', ids, lambda engine, ids: sync.sync_scopus(
+            engine, sync_store, ids, API_KEY, SCOPUS_BATCH_SIZE, SCOPUS_PAGE_SIZE))
+    results = await scopus.fetch_authors(engine, ids, API_KEY, SCOPUS_BATCH_SIZE, SCOPUS_PAGE_SIZE)
+    return {author_id: make_scopus_part(results.get(author_id)) for author_id in ids}
+
+
+async def fetch_scholar_part(engine, author, upstreams):
+    if 'scholar' not in upstreams:
+        return None
+    # Runs as its own task under gather, so the tag only covers this author
+    metrics.tag(author=author[0])
+    if sync_store is not None:
+        return await upstream.single_flight(engine, 'scholar_sync', author[2], sync.sync_scholar, sync_store, author[2])
+    profile = await scholar.fetch_profile(engine, author[2])
+    return {'profile': profile, 'refreshed_at': profile.get('fetched_at', time.time())} if profile is not None else None
+
+
+# Fetch the per-author records the reports are built from. `previous` maps
+# author_id -> record to carry over data for authors whose fetch failed.
+async def fetch_author_records(engine, author_ids, upstreams=ALL_UPSTREAMS, previous=None):
+    previous = previous or {}
+    scopus_parts, scholar_parts = await asyncio.gather(
+        fetch_scopus_parts(engine, author_ids, upstreams),
+        asyncio.gather(*(fetch_scholar_part(engine, author, upstreams) for author in author_ids)),
+    )
+    return [
+        make_record(author, scopus_parts.get(author[0]), scholar_part, previous.get(author[0]))
+        for author, scholar_part in zip(author_ids, scholar_parts)
+    ]
+
+
+# Like fetch_author_records, but hands each record to `emit` as soon as that
+# author is complete. The (batched) Scopus searches run once for everyone
+# while the Scholar profiles come in one by one.
+async def stream_author_records(engine, emit, author_ids, upstreams=ALL_UPSTREAMS):
+    scopus_task = asyncio.ensure_future(fetch_scopus_parts(engine, author_ids, upstreams))
+
+    async def fetch_one(author):
+        scholar_part = await fetch_scholar_part(engine, author, upstreams)
+        scopus_parts = await scopus_task
+        emit(make_record(author, scopus_parts.get(author[0]), scholar_part))
+
+    await asyncio.gather(*(fetch_one(author) for author in author_ids))
+
+
+# Fetch all of an author's papers from Scopus using author ID, following the
+# result pages to completion
+async def fetch_author_papers_async(engine, author_id):
+    response_json = (await scopus.fetch_authors(engine, [author_id], API_KEY, 0, SCOPUS_PAGE_SIZE))[author_id]
+    if response_json is None:
+        print(f"Error: Unable to fetch data for author ID {author_id}.")
+    return response_json
+
+
+def fetch_author_papers(author_id):
+    return run_upstream(fetch_author_papers_async, author_id)
+
+
+async def fetch_google_scholar_data_async(engine, gscholar_link):
+    return scholar.profile_summary(await scholar.fetch_profile(engine, gscholar_link))
+
+
+def fetch_google_scholar_data(gscholar_link):
+    return run_upstream(fetch_google_scholar_data_async, gscholar_link)
+
+
+async def fetch_yearly_citations_async(engine, gscholar_link):
+    return scholar.profile_yearly_citations(await scholar.fetch_profile(engine, gscholar_link))
+
+
+def fetch_yearly_citations(gscholar_link):
+    return run_upstream(fetch_yearly_citations_async, gscholar_link)
+
+
+async def fetch_google_scholar_papers_async(engine, author_url):
+    return scholar.profile_papers(await scholar.fetch_profile(engine, author_url))
+
+
+def fetch_google_scholar_papers(author_url):
+    return run_upstream(fetch_google_scholar_papers_async, author_url)
+
+
+def record_profile(record):
+    return record['scholar']['profile'] if record['scholar'] else None
+
+
+def build_author_row(record):
+    total_papers_scopus, total_citations_scopus, h_index_scopus = record['scopus']['summary'] if record['scopus'] else (0, 0, 0)
+    profile = record_profile(record)
+    total_papers_gscholar, total_citations_gscholar, h_index_gscholar, i10_index = scholar.profile_summary(profile)
+    yearly_citations = scholar.profile_yearly_citations(profile)
+
+    # Convert yearly_citations dictionary to a string format for easy display
+    yearly_citations_str = ', '.join(f"{year}: {count}" for year, count in yearly_citations.items())
+
+    return {
+        'Name': record['name'],
+        'Total Papers (Google Scholar)': total_papers_gscholar or 0,
+        'Total Citations (Google Scholar)': total_citations_gscholar or 0,
+        'H-Index (Google Scholar)': h_index_gscholar or 0,
+        'I10 Index (Google Scholar)': i10_index or 0,
+        'Total Papers (Scopus)': total_papers_scopus or 0,
+        'Total Citations (Scopus)': total_citations_scopus or 0,
+        'H-Index (Scopus)': h_index_scopus or 0,
+        'Yearly Citations': yearly_citations_str  # Store as a formatted string
+    }
+
+
+# Build the rows /generate_report returns for `source` from author records
+def build_report(source, records):
+    with metrics.timed(metrics.REPORT_BUILD_SECONDS, source=source):
+        return build_report_rows(source, records)
+
+
+# Column label for each upstream in the aggregate report
+SOURCE_LABELS = {'scopus': 'Scopus', 'scholar': 'Google Scholar'}
+
+
+def format_yearly(years, counts):
+    return ', '.join(f"{year}: {count}" for year, count in zip(years, counts) if count)
+
+
+# Department-level report: one row for all authors together, then one per
+# department when the roster has more than one, with the totals, means and
+# percentiles of the per-author metrics the analytics engine computes from
+# each paper list
+def build_aggregate_rows(records):
+    import analytics
+
+    stats = analytics.for_records(records, {author_id: entry['department'] for author_id, entry in get_roster().by_id.items()})
+    groups = [('All', stats.overall(), 0)]
+    if len(stats.departments) > 1:
+        groups += [(department or 'No department', stats, index) for index, department in enumerate(stats.departments)]
+
+    rows = []
+    for name, group, index in groups:
+        row = {'Department': str(name), 'Authors': int(group.department_sizes()[index])}
+        for source, label in SOURCE_LABELS.items():
+            totals = group.department_totals(source)
+            means = group.department_means(source)
+            h_percentiles = group.department_percentiles(source, 'h_index')[index]
+            row.update({
+                f'Total Papers ({label})': int(totals['papers'][index]),
+                f'Total Citations ({label})': int(totals['citations'][index]),
+                f'Average Citations ({label})': round(float(means['citations'][index]), 2),
+                f'Average H-Index ({label})': round(float(means['h_index'][index]), 2),
+                f'Median H-Index ({label})': round(float(h_percentiles[analytics.PERCENTILES.index(50)]), 2),
+                f'H-Index Percentiles ({label})': ', '.join(
+                    f"P{percentile}: {value:g}" for percentile, value in zip(analytics.PERCENTILES, h_percentiles)),
+                f'Average G-Index ({label})': round(float(means['g_index'][index]), 2),
+                f'Average I10 Index ({label})': round(float(means['i10_index'][index]), 2),
+            })
+            years, counts = group.yearly_papers(source)
+            row[f'Yearly Papers ({label})'] = format_yearly(years, counts[index])
+        years, totals = group.yearly_citation_totals()
+        row['Yearly Citations (Google Scholar)'] = format_yearly(years, totals[index])
+        rows.append(row)
+    return rows
+
+
+def build_report_rows(source, records):
+    # Department-level aggregates
+    if source == 'aggregate':
+        return build_aggregate_rows(records)
+
+    # Google Scholar paper details
+    if source == 'paperDetails':
+        return [{'Name': record['name'], 'Papers': scholar.profile_papers(record_profile(record))} for record in records]
+
+    # Papers from both upstreams matched up, with the overlap per author
+    if source == 'paperDetailsMerged':
+        rows = []
+        for record in records:
+            papers = matching.merge_papers(record['scopus']['papers'] if record['scopus'] else [],
+                                           scholar.profile_papers(record_profile(record)))
+            summary = matching.merged_summary(papers)
+            rows.append({
+                'Name': record['name'],
+                'Papers': papers,
+                'Matched Papers': summary['matched'],
+                'Scopus Only': summary['scopus_only'],
+                'Google Scholar Only': summary['scholar_only'],
+                'Deduplicated Citations': summary['citations'],
+            })
+        return rows
+
+    # Scopus paper details
+    if source == 'paperDetailsScopus':
+        return [
+            {
+                "Name": record['name'],
+                "ScopusPapers": record['scopus']['papers'] if record['scopus'] else [],
+                "ProfileLink": f"https://www.scopus.com/authid/detail.uri?authorId={record['id']}"
+            }
+            for record in records
+        ]
+
+    combined_data = [build_author_row(record) for record in records]
+
+    # Handle "googleScholarOnly" source
+    if source == 'googleScholarOnly':
+        google_scholar_data = []
+        for entry in combined_data:
+            google_scholar_data.append({
+                'Name': entry['Name'],
+                'Total Citations': entry['Total Citations (Google Scholar)'],
+                'H-Index': entry['H-Index (Google Scholar)'],
+                'I10 Index': entry['I10 Index (Google Scholar)'],
+                'Yearly Citations': entry['Yearly Citations']
+            })
+        return google_scholar_data
+
+    # If source is "average", calculate individual averages per author
+    if source == 'average':
+        avg_data = []
+
+        for entry in combined_data:
+            avg_data.append({
+                'Name': entry['Name'],
+                'Total Papers (Google Scholar)': entry['Total Papers (Google Scholar)'],
+                'Total Citations (Google Scholar)': entry['Total Citations (Google Scholar)'],
+                'H-Index (Google Scholar)': entry['H-Index (Google Scholar)'],
+                'I10 Index (Google Scholar)': entry['I10 Index (Google Scholar)'],
+                'Total Papers (Scopus)': entry['Total Papers (Scopus)'],
+                'Total Citations (Scopus)': entry['Total Citations (Scopus)'],
+                'H-Index (Scopus)': entry['H-Index (Scopus)'],
+                'Yearly Citations': entry['Yearly Citations'],
+            })
+
+        return avg_data
+
+    # Filter data based on the source requested (if not 'average')
+    filtered_data = []
+    for entry in combined_data:
+        filtered_entry = {'Name': entry['Name']}
+        if source == 'googleScholar' or source == 'both':
+            filtered_entry['Total Papers (Google Scholar)'] = entry['Total Papers (Google Scholar)']
+            filtered_entry['Total Citations (Google Scholar)'] = entry['Total Citations (Google Scholar)']
+            filtered_entry['H-Index (Google Scholar)'] = entry['H-Index (Google Scholar)']
+            filtered_entry['I10 Index (Google Scholar)'] = entry['I10 Index (Google Scholar)']
+            filtered_entry['Yearly Citations'] = entry['Yearly Citations']
+        if source == 'scopus' or source == 'both':
+            filtered_entry['Total Papers (Scopus)'] = entry['Total Papers (Scopus)']
+            filtered_entry['Total Citations (Scopus)'] = entry['Total Citations (Scopus)']
+            filtered_entry['H-Index (Scopus)'] = entry['H-Index (Scopus)']
+
+        filtered_data.append(filtered_entry)
+
+    return filtered_data
+
+
+# Filters, sorting and paging for a report, from the /generate_report request
+# body: "department" and "authors" (Scopus IDs or names) each a string or a
+# list, "year_from"/"year_to", "sort" (a SORT_COLUMNS key, or "papers",
+# "citations" or "h_index"), "order" ("asc" or "desc") and "page"/"limit".
+# Raises ValueError for invalid parameters, including departments the roster
+# does not have.
+def parse_report_query(source, data):
+    def string_list(name):
+        value = data.get(name)
+        if value is None:
+            return None
+        values = [value] if isinstance(value, str) else value
+        if not isinstance(values, list) or not all(isinstance(item, str) for item in values):
+            raise ValueError(f'"{name}" must be a string or a list of strings')
+        return values
+
+    def integer(name, minimum=None):
+        value = data.get(name)
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, int) or (minimum is not None and value < minimum):
+            raise ValueError(f'"{name}" must be an integer' + (f' of at least {minimum}' if minimum is not None else ''))
+        return value
+
+    sort = data.get('sort')
+    if sort in ('papers', 'citations', 'h_index'):
+        sort = ('scopus_' if source == 'paperDetailsScopus' else 'scholar_') + sort
+    if sort is not None and sort not in SORT_COLUMNS:
+        raise ValueError(f'"sort" must be one of {", ".join(["papers", "citations", "h_index", *SORT_COLUMNS])}')
+    order = data.get('order') or ('asc' if sort in (None, 'name') else 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('"order" must be "asc" or "desc"')
+
+    query = {
+        'departments': string_list('department'),
+        'authors': string_list('authors'),
+        'year_from': integer('year_from'),
+        'year_to': integer('year_to'),
+        'sort': sort,
+        'order': order,
+        'page': integer('page', 1),
+        'limit': integer('limit', 1),
+    }
+    if query['page'] is not None and query['limit'] is None:
+        raise ValueError('"page" needs a "limit"')
+    if query['departments'] is not None:
+        departments = get_roster().departments()
+        known = {department.casefold() for department in departments}
+        unknown = [department for department in query['departments'] if department.casefold() not in known]
+        if unknown:
+            raise ValueError(f'Unknown department {unknown[0]!r}; the roster has {", ".join(departments) or "none"}')
+    return query
+
+
+# Whether the query is the whole roster, unfiltered, in roster order
+def is_full_report(query):
+    return all(query[name] is None for name in ('departments', 'authors', 'year_from', 'year_to', 'sort', 'limit'))
+
+
+def page_slice(query):
+    if query['limit'] is None:
+        return slice(None)
+    start = ((query['page'] or 1) - 1) * query['limit']
+    return slice(start, start + query['limit'])
+
+
+# Roster authors matching the query, and whether fetching can be limited to
+# the requested page before the data is in (sorting on a metric needs every
+# matching author's data first)
+def select_authors(query):
+    authors = get_roster().select(query['departments'], query['authors'])
+    if query['sort'] == 'name':
+        authors.sort(key=lambda author: author[1].casefold(), reverse=query['order'] == 'desc')
+    elif query['sort'] is None and query['order'] == 'desc':
+        authors.reverse()
+    return authors, query['sort'] in (None, 'name')
+
+
+# The records for the requested page, given the records of every author
+# select_authors returned (or just that page's, when it said so)
+def query_records(records, query, paged):
+    # Sorted on the totals of the requested years
+    records = [limit_years(record, query['year_from'], query['year_to']) for record in records]
+    if not paged:
+        column = SORT_COLUMNS[query['sort']]
+        records = sorted(records, key=lambda record: build_author_row(record)[column], reverse=query['order'] == 'desc')
+        records = records[page_slice(query)]
+    return records
+
+
+# Papers, citations, h-index and i10-index of a paper list
+def paper_totals(papers):
+    citations = sorted((scopus.citation_count(paper) for paper in papers), reverse=True)
+    h_index = sum(count >= rank for rank, count in enumerate(citations, 1))
+    return len(citations), sum(citations), h_index, sum(count >= 10 for count in citations)
+
+
+# The record with its yearly citations and paper lists cut down to papers and
+# years within year_from..year_to (inclusive), and the paper, citation, h- and
+# i10-index totals of both upstreams recomputed from the papers left. The
+# range is kept in "years", which tells the filtered record apart from the
+# whole one (see analytics.records_fingerprint).
+def limit_years(record, year_from, year_to):
+    if year_from is None and year_to is None:
+        return record
+
+    def in_range(year):
+        year = str(year or '')[:4]
+        if not year.isdigit():
+            return False
+        return (year_from is None or int(year) >= year_from) and (year_to is None or int(year) <= year_to)
+
+    record = dict(record, years=(year_from, year_to))
+    if record['scopus']:
+        papers = [paper for paper in record['scopus']['papers'] if in_range(paper['year'])]
+        record['scopus'] = {**record['scopus'], 'summary': paper_totals(papers)[:3], 'papers': papers}
+    profile = record_profile(record)
+    if profile:
+        papers = [paper for paper in profile['papers'] if in_range(paper.get('year'))]
+        stats = profile['stats']
+        if stats:
+            _, citations, h_index, i10_index = paper_totals(papers)
+            stats = {**stats, 'citations': citations, 'h_index': h_index, 'i10_index': i10_index}
+        record['scholar'] = {**record['scholar'], 'profile': {
+            **profile,
+            'stats': stats,
+            'yearly_citations': {year: count for year, count in profile['yearly_citations'].items() if in_range(year)},
+            'papers': papers,
+        }}
+    return record
+
+
+def build_reports(records):
+    return {source: build_report(source, records) for source in REPORT_SOURCES}
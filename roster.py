@@ -0,0 +1,110 @@
+import csv
+import json
+import sqlite3
+
+# Table read when the roster is an SQLite database
+DEFAULT_TABLE = 'roster'
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+# Roster entries as dicts with "id", "name", "link" and "department", from a
+# CSV file (columns scopus_id, name, scholar_link and optionally department),
+# a JSON list of such objects or of (id, name, link) triples like
+# reports.AUTHOR_IDS, or an SQLite table with the CSV columns
+def read_roster(path, table=DEFAULT_TABLE):
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        db = sqlite3.connect(path)
+        db.row_factory = sqlite3.Row
+        try:
+            entries = [dict(row) for row in db.execute(f'SELECT * FROM "{table}"')]
+        finally:
+            db.close()
+    else:
+        with open(path, newline='') as roster_file:
+            if path.lower().endswith('.json'):
+                entries = json.load(roster_file)
+            else:
+                entries = list(csv.DictReader(roster_file))
+    return [make_entry(entry) for entry in entries]
+
+
+def make_entry(entry):
+    if isinstance(entry, dict):
+        values = (entry.get('scopus_id'), entry.get('name'), entry.get('scholar_link'), entry.get('department'))
+    else:
+        values = (list(entry) + [None])[:4]
+    author_id, name, link, department = (str(value or '').strip() for value in values)
+    return {'id': author_id, 'name': name, 'link': link, 'department': department}
+
+
+class Roster:
+    """The authors reports cover, in roster order and indexed by Scopus ID,
+    name and department (names and departments match case-insensitively).
+
+    The fetch functions take authors as (scopus_id, name, scholar_link)
+    tuples; select() and authors() return them in that form.
+    """
+
+    def __init__(self, entries):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_department = {}
+        for entry in entries:
+            if entry['id'] in self.by_id:
+                # Authors listed twice are covered once
+                continue
+            self.by_id[entry['id']] = entry
+            self.by_name.setdefault(entry['name'].casefold(), []).append(entry)
+            self.by_department.setdefault(entry['department'].casefold(), []).append(entry)
+        self.entries = list(self.by_id.values())
+        self._positions = {entry['id']: position for position, entry in enumerate(self.entries)}
+
+    @classmethod
+    def from_authors(cls, author_ids):
+        return cls([make_entry(author) for author in author_ids])
+
+    # "ROSTER": "roster.csv" or {"path": ..., "table": ...}; without it the
+    # built-in `default_authors` list is used
+    @classmethod
+    def from_config(cls, roster_config, default_authors):
+        if not roster_config:
+            return cls.from_authors(default_authors)
+        if isinstance(roster_config, str):
+            roster_config = {'path': roster_config}
+        return cls(read_roster(roster_config['path'], roster_config.get('table', DEFAULT_TABLE)))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def authors(self):
+        return [author_tuple(entry) for entry in self.entries]
+
+    def departments(self):
+        return sorted({entry['department'] for entry in self.entries if entry['department']})
+
+    # Authors in any of `departments` and, if given, among `authors` (Scopus
+    # IDs or names), in roster order. None means no restriction.
+    def select(self, departments=None, authors=None):
+        if departments is None and authors is None:
+            return self.authors()
+
+        candidates = None
+        if departments is not None:
+            candidates = {
+                entry['id']
+                for department in departments
+                for entry in self.by_department.get(department.casefold(), [])
+            }
+        if authors is not None:
+            wanted = set()
+            for author in authors:
+                if author in self.by_id:
+                    wanted.add(author)
+                wanted.update(entry['id'] for entry in self.by_name.get(author.casefold(), []))
+            candidates = wanted if candidates is None else candidates & wanted
+        return [author_tuple(self.by_id[author_id]) for author_id in sorted(candidates, key=self._positions.get)]
+
+
+def author_tuple(entry):
+    return entry['id'], entry['name'], entry['link']
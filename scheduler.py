@@ -0,0 +1,44 @@
+import argparse
+import time
+
+import reports
+import snapshots
+from settings import config, run_upstream
+
+# Refresh every author on the roster and save the result as a new snapshot.
+# The refresh bypasses cache lookups (but still fills the cache) so each
+# snapshot reflects upstream as of now.
+def refresh(store, author_ids=None):
+    started = time.time()
+    author_ids = reports.get_roster().authors() if author_ids is None else author_ids
+    records = run_upstream(reports.fetch_author_records, author_ids, reports.ALL_UPSTREAMS, store.latest_records(), revalidating=True)
+    version = store.save(records, reports.build_reports(records))
+    print(f"Saved report snapshot {version} for {len(records)} authors in {time.time() - started:.1f}s")
+    return version
+
+
+def main():
+    snapshot_config = config.get('SNAPSHOTS') or {}
+    parser = argparse.ArgumentParser(description='Refresh the roster on an interval and write report snapshots.')
+    parser.add_argument('--once', action='store_true', help='refresh once and exit')
+    parser.add_argument('--interval', type=float, default=snapshot_config.get('interval', snapshots.DEFAULT_INTERVAL),
+                        help='seconds between refreshes')
+    args = parser.parse_args()
+
+    store = snapshots.SnapshotStore.from_config(snapshot_config)
+    if store is None:
+        raise SystemExit('Report snapshots are disabled in config.json')
+
+    while True:
+        started = time.time()
+        try:
+            refresh(store)
+        except Exception as e:
+            print(f"Error refreshing report snapshot: {e}")
+        if args.once:
+            break
+        time.sleep(max(0, args.interval - (time.time() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import time
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lxml import etree, html as lxml_html
+
+import metrics
+import upstream
+
+SCHOLAR_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+CAPTCHA_MARKER = 'Our systems have detected unusual traffic'
+
+# Largest number of publication rows a profile page lists (the pagesize
+# parameter); a profile page shows only 20 without it
+PAGE_SIZE = 100
+
+# Order of the cells in the "Cited by" table: each row has an "All" and a
+# "Since <year>" column
+STAT_FIELDS = ['citations', 'citations_recent', 'h_index', 'h_index_recent', 'i10_index', 'i10_index_recent']
+
+
+# Precompiled selectors for the three regions of a profile page the reports
+# read. A cheap substring match in XPath narrows the candidates, then
+# with_class keeps the ones that really have the class (as a whole token, like
+# BeautifulSoup's class_ matching).
+STAT_CELLS = etree.XPath('//td[contains(@class, "gsc_rsb_std")]')
+HISTOGRAM_YEARS = etree.XPath('//span[contains(@class, "gsc_g_t")]')
+HISTOGRAM_COUNTS = etree.XPath('//span[contains(@class, "gsc_g_al")]')
+PAPER_ROWS = etree.XPath('//tr[contains(@class, "gsc_a_tr")]')
+# The multi-class ones match the whole attribute, as class_ does for them
+PAPER_CITATIONS_CLASS = 'gsc_a_ac gs_ibl'
+PAPER_YEAR_CLASS = 'gsc_a_h gsc_a_hc gs_ibl'
+
+
+def parse_stats(soup, gscholar_link):
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    try:
+        cells = soup.find_all('td', class_='gsc_rsb_std')
+        for field, cell in zip(STAT_FIELDS, cells):
+            stats[field] = int(cell.text.strip())
+    except ValueError as e:
+        print(f"Error parsing Google Scholar data for {gscholar_link}: {e}")
+        return None
+    return stats
+
+
+def parse_yearly_citations(soup):
+    yearly_data = {}
+
+    # Years and citation counts are two parallel lists of spans in the histogram
+    year_elements = soup.find_all('span', class_='gsc_g_t')
+    citation_elements = soup.find_all('span', class_='gsc_g_al')
+
+    for year_elem, citation_elem in zip(year_elements, citation_elements):
+        year = year_elem.text.strip()
+        citation_count = citation_elem.text.strip()
+
+        # Clean the citation count and convert to int
+        yearly_data[year] = int(citation_count) if citation_count.isdigit() else 0
+
+    return yearly_data
+
+
+def parse_paper_rows(soup):
+    papers = []
+    for entry in soup.find_all('tr', class_='gsc_a_tr'):
+        title_element = entry.find('a', class_='gsc_a_at')
+        citations_element = entry.find('a', class_='gsc_a_ac gs_ibl')
+        year_element = entry.find('span', class_='gsc_a_h gsc_a_hc gs_ibl')
+
+        title = title_element.text.strip() if title_element else 'N/A'
+        link = f"https://scholar.google.com{title_element['href']}" if title_element and 'href' in title_element.attrs else 'N/A'
+        citations = citations_element.text.strip() if citations_element else '0'
+        year = year_element.text.strip() if year_element else 'N/A'
+
+        papers.append({
+            'title': title,
+            'link': link,
+            'citations': citations,
+            # If year is empty, set it to 'N/A'
+            'year': year or 'N/A'
+        })
+    return papers
+
+
+def make_profile(gscholar_link, stats, yearly_citations, papers):
+    if not papers:
+        print(f"No paper entries found for {gscholar_link}. The page structure might have changed.")
+    return {
+        'link': gscholar_link,
+        'stats': stats,
+        'yearly_citations': yearly_citations,
+        'papers': papers,
+    }
+
+
+# Reference BeautifulSoup implementation of parse_profile, kept to check the
+# lxml extraction against (see benchmark.py parse)
+def parse_profile_soup(html, gscholar_link):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    if CAPTCHA_MARKER in soup.text:
+        print(f"CAPTCHA detected for {gscholar_link}. Unable to fetch profile.")
+        return None
+
+    papers = parse_paper_rows(soup)
+    return make_profile(gscholar_link, parse_stats(soup, gscholar_link), parse_yearly_citations(soup), papers)
+
+
+def with_class(elements, name):
+    return [element for element in elements if name in element.get('class').split()]
+
+
+def element_text(element):
+    return ''.join(element.itertext()).strip()
+
+
+def extract_stats(tree, gscholar_link):
+    stats = dict.fromkeys(STAT_FIELDS, 0)
+    try:
+        for field, cell in zip(STAT_FIELDS, with_class(STAT_CELLS(tree), 'gsc_rsb_std')):
+            stats[field] = int(element_text(cell))
+    except ValueError as e:
+        print(f"Error parsing Google Scholar data for {gscholar_link}: {e}")
+        return None
+    return stats
+
+
+def extract_yearly_citations(tree):
+    yearly_data = {}
+    for year_elem, citation_elem in zip(with_class(HISTOGRAM_YEARS(tree), 'gsc_g_t'), with_class(HISTOGRAM_COUNTS(tree), 'gsc_g_al')):
+        citation_count = element_text(citation_elem)
+        yearly_data[element_text(year_elem)] = int(citation_count) if citation_count.isdigit() else 0
+    return yearly_data
+
+
+def extract_paper_rows(tree):
+    papers = []
+    for row in with_class(PAPER_ROWS(tree), 'gsc_a_tr'):
+        # One walk over the row's links and spans instead of a query per field
+        title_element = citations_element = year_element = None
+        for element in row.iter('a', 'span'):
+            element_class = element.get('class', '')
+            if element.tag == 'a':
+                if title_element is None and 'gsc_a_at' in element_class.split():
+                    title_element = element
+                elif citations_element is None and element_class == PAPER_CITATIONS_CLASS:
+                    citations_element = element
+            elif year_element is None and element_class == PAPER_YEAR_CLASS:
+                year_element = element
+
+        href = title_element.get('href') if title_element is not None else None
+        year = element_text(year_element) if year_element is not None else 'N/A'
+
+        papers.append({
+            'title': element_text(title_element) if title_element is not None else 'N/A',
+            'link': f"https://scholar.google.com{href}" if href is not None else 'N/A',
+            'citations': element_text(citations_element) if citations_element is not None else '0',
+            # If year is empty, set it to 'N/A'
+            'year': year or 'N/A'
+        })
+    return papers
+
+
+# Parse a profile page once into everything the reports need: the "Cited by"
+# stats table, the yearly citation histogram and the publication rows. lxml
+# builds the tree in C and the precompiled selectors above pick out just those
+# regions, which is an order of magnitude cheaper than a BeautifulSoup tree.
+def parse_profile(html, gscholar_link):
+    with metrics.timed(metrics.PARSE_SECONDS, parser='scholar_profile'):
+        return extract_profile(html, gscholar_link)
+
+
+def is_captcha_page(html, gscholar_link):
+    marker = CAPTCHA_MARKER.encode('utf-8') if isinstance(html, bytes) else CAPTCHA_MARKER
+    if marker in html:
+        print(f"CAPTCHA detected for {gscholar_link}. Unable to fetch profile.")
+        return True
+    return False
+
+
+def parse_tree(html):
+    try:
+        return lxml_html.document_fromstring(html)
+    except etree.ParserError:
+        # Empty document
+        return None
+
+
+def extract_profile(html, gscholar_link):
+    if is_captcha_page(html, gscholar_link):
+        return None
+
+    tree = parse_tree(html)
+    if tree is None:
+        return make_profile(gscholar_link, dict.fromkeys(STAT_FIELDS, 0), {}, [])
+
+    return make_profile(gscholar_link, extract_stats(tree, gscholar_link), extract_yearly_citations(tree), extract_paper_rows(tree))
+
+
+# Only the publication rows of a page, for the pages after the first
+def parse_paper_page(html, gscholar_link):
+    with metrics.timed(metrics.PARSE_SECONDS, parser='scholar_papers'):
+        if is_captcha_page(html, gscholar_link):
+            return None
+        tree = parse_tree(html)
+        return extract_paper_rows(tree) if tree is not None else []
+
+
+# The profile link with the publication list window set to cstart..cstart+pagesize,
+# sorted by citations (Scholar's default) or by `sortby` ("pubdate", "title")
+def page_url(gscholar_link, cstart=0, pagesize=PAGE_SIZE, sortby=None):
+    parts = urlsplit(gscholar_link)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in ('cstart', 'pagesize', 'sortby')]
+    query += [('cstart', cstart), ('pagesize', pagesize)]
+    if sortby:
+        query.append(('sortby', sortby))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+# Stable key for a publication row: the citation id in its link
+def paper_key(paper):
+    citation = parse_qs(urlsplit(paper['link']).query).get('citation_for_view')
+    return citation[0] if citation else f"{paper['title']}|{paper['year']}"
+
+
+# Fetch one page of a profile and parse it with `parse(html, gscholar_link)`.
+# Pages are not cached themselves: fetch_profile caches the parsed profile
+# they add up to, and incremental sync wants the newest pages as they are.
+async def fetch_page(engine, gscholar_link, cstart, pagesize, parse, sortby=None):
+    url = page_url(gscholar_link, cstart, pagesize, sortby)
+    response = await engine.get(url, headers=SCHOLAR_HEADERS)
+    if not response.ok:
+        print(f"Error fetching Google Scholar data from {url}: Status code {response.status}")
+        return None
+    return parse(response.body, gscholar_link)
+
+
+# The publication rows of a profile from `cstart` on, one list per page. Pages
+# are fetched one after another (their number is not known up front) and the
+# first short page is the last one. A page that cannot be fetched ends the
+# iteration with None.
+async def iter_paper_pages(engine, gscholar_link, cstart=0, pagesize=PAGE_SIZE, sortby=None):
+    while True:
+        rows = await fetch_page(engine, gscholar_link, cstart, pagesize, parse_paper_page, sortby)
+        yield rows
+        if rows is None or len(rows) < pagesize:
+            return
+        cstart += pagesize
+
+
+# The full profile: stats and histogram from the first page, and the complete
+# publication list from as many pages as it takes. A profile whose list could
+# not be fetched to the end is dropped rather than reported short. The profile
+# keeps when it was fetched ("fetched_at"), which stays with it in the cache.
+async def download_profile(engine, gscholar_link, pagesize=PAGE_SIZE):
+    profile = await fetch_page(engine, gscholar_link, 0, pagesize, parse_profile)
+    if profile is None:
+        return None
+
+    if len(profile['papers']) >= pagesize:
+        async for rows in iter_paper_pages(engine, gscholar_link, pagesize, pagesize):
+            if rows is None:
+                print(f"Unable to fetch the full publication list for {gscholar_link}.")
+                return None
+            profile['papers'].extend(rows)
+    profile['fetched_at'] = time.time()
+    return profile
+
+
+# The profile's stats and histogram with its newest publications: pages sorted
+# by publication date are fetched until one reaches a paper in `known_keys`
+# (or comes back short), so an author with no new papers costs one request.
+# Returns the first page's profile with the rows of every page fetched.
+async def download_recent(engine, gscholar_link, known_keys, pagesize=PAGE_SIZE):
+    profile = await fetch_page(engine, gscholar_link, 0, pagesize, parse_profile, 'pubdate')
+    if profile is None or not profile['stats']:
+        return None
+
+    rows = profile['papers']
+    cstart = 0
+    while len(rows) == pagesize and not any(paper_key(paper) in known_keys for paper in rows):
+        cstart += pagesize
+        rows = await fetch_page(engine, gscholar_link, cstart, pagesize, parse_paper_page, 'pubdate')
+        if rows is None:
+            print(f"Unable to fetch the recent publications of {gscholar_link}.")
+            return None
+        profile['papers'].extend(rows)
+    return profile
+
+
+# Parsed profile for a Scholar link, served from the engine's cache when possible
+async def fetch_profile(engine, gscholar_link):
+    return await upstream.cached(engine, 'scholar', gscholar_link, download_profile, gscholar_link)
+
+
+# (total_papers, total_citations, h_index, i10_index), or all None when the
+# profile could not be fetched or parsed
+def profile_summary(profile):
+    if not profile or not profile['stats']:
+        return None, None, None, None
+    stats = profile['stats']
+    return len(profile['papers']), stats['citations'], stats['h_index'], stats['i10_index']
+
+
+def profile_yearly_citations(profile):
+    return profile['yearly_citations'] if profile else {}
+
+
+def profile_papers(profile):
+    return profile['papers'] if profile else []
@@ -0,0 +1,297 @@
+import asyncio
+import time
+
+import metrics
+import upstream
+
+SCOPUS_SEARCH_URL = 'https://api.elsevier.com/content/search/scopus'
+
+# Only the fields parse_scopus_data and parse_scopus_papers read, plus the
+# record identifier incremental sync keys papers by
+SCOPUS_FIELDS = ['citedby-count', 'dc:identifier', 'dc:title', 'prism:coverDate', 'prism:doi']
+
+# Largest page the Search API serves in the STANDARD view
+PAGE_SIZE = 200
+
+# Batched queries also need each entry's author list to split the results
+# back out per author; the author field is only served in the COMPLETE view,
+# whose pages hold at most 25 results
+AUTHOR_FIELDS = SCOPUS_FIELDS + ['author']
+AUTHOR_VIEW = 'COMPLETE'
+COMPLETE_PAGE_SIZE = 25
+
+# All a citation refresh reads: which record, and its current count
+CITATION_FIELDS = ['dc:identifier', 'citedby-count']
+
+# The API refuses start offsets past this; larger result sets need the cursor
+START_LIMIT = 5000
+
+# Most author IDs OR-ed into one batched query. Batching only pays off when
+# the batch's results fit a COMPLETE page or two (see plan_batches); a full
+# paper list is cheaper as a single-author search at PAGE_SIZE results a page.
+BATCH_SIZE = 25
+
+
+def scopus_headers(api_key):
+    return {
+        'X-ELS-APIKey': api_key,
+        'Accept': 'application/json'
+    }
+
+
+# Parse Scopus data
+def parse_scopus_data(response_json):
+    total_papers = 0
+    total_citations = 0
+    h_index = 0
+    
+    if response_json and 'search-results' in response_json:
+        entries = response_json['search-results'].get('entry', [])
+        total_papers = len(entries)
+        
+        citations = [int(entry.get('citedby-count', '0')) for entry in entries]
+        total_citations = sum(citations)
+        
+        # Calculate H-index
+        citations.sort(reverse=True)
+        h_index = sum(c >= i + 1 for i, c in enumerate(citations))
+    
+    return total_papers, total_citations, h_index
+
+
+def parse_scopus_paper(entry):
+    return {
+        'title': entry.get('dc:title'),
+        'year': entry.get('prism:coverDate', '')[:4], 
+        'citations': entry.get('citedby-count'),
+        'link': entry.get('prism:doi')
+    }
+
+
+# Citation count of a parsed paper, Scopus' or Scholar's: both keep it as the
+# string the upstream showed, which may be empty
+def citation_count(paper):
+    citations = str(paper.get('citations') or '')
+    return int(citations) if citations.isdigit() else 0
+
+
+def parse_scopus_papers(response_json):
+    papers = []
+    if response_json and 'search-results' in response_json:
+        entries = response_json['search-results'].get('entry', [])
+        for entry in entries:
+            papers.append(parse_scopus_paper(entry))
+    return papers
+
+
+# Stable key for a search result entry
+def paper_key(entry):
+    return entry.get('dc:identifier') or entry.get('prism:doi') or entry.get('dc:title')
+
+
+# Search clause for records added to Scopus after the `since` timestamp
+def loaded_after(since):
+    return f"ORIG-LOAD-DATE AFT {time.strftime('%Y%m%d', time.gmtime(since))}"
+
+
+def with_clause(query, clause):
+    return f'({query}) AND {clause}' if clause else query
+
+
+def page_entries(page):
+    entries = page['search-results'].get('entry', [])
+    # An empty result set comes back as a single entry carrying an "error" key
+    return [entry for entry in entries if 'error' not in entry]
+
+
+async def fetch_page(engine, query, api_key, start=None, cursor=None, page_size=PAGE_SIZE, fields=SCOPUS_FIELDS, view=None):
+    params = {'query': query, 'count': page_size, 'field': ','.join(fields)}
+    if view:
+        params['view'] = view
+    if cursor is not None:
+        params['cursor'] = cursor
+    else:
+        params['start'] = start or 0
+
+    response = await engine.get(SCOPUS_SEARCH_URL, headers=scopus_headers(api_key), params=params, cache_source='scopus_http')
+    if not response.ok:
+        where = f'cursor {cursor}' if cursor is not None else f'start {start or 0}'
+        print(f"Error: Scopus query {query} failed at {where}. Status code: {response.status}")
+        return None
+    with metrics.timed(metrics.PARSE_SECONDS, parser='scopus_json'):
+        return response.json()
+
+
+async def fetch_by_cursor(engine, query, api_key, page_size=PAGE_SIZE, fields=SCOPUS_FIELDS, view=None):
+    # Cursor pages have to be walked one after another
+    entries = []
+    cursor = '*'
+    while True:
+        page = await fetch_page(engine, query, api_key, cursor=cursor, page_size=page_size, fields=fields, view=view)
+        if page is None:
+            return None
+        results = page['search-results']
+        batch = page_entries(page)
+        entries.extend(batch)
+        next_cursor = results.get('cursor', {}).get('@next')
+        if len(batch) < page_size or not next_cursor or next_cursor == cursor:
+            return entries
+        cursor = next_cursor
+
+
+# Run a Scopus search to completion and return it in the shape of a single
+# search response, so the parse_scopus_* functions work on it unchanged.
+# Result sets that fit under START_LIMIT are fetched with all pages after the
+# first one in parallel; anything larger follows the cursor.
+async def fetch_search(engine, query, api_key, page_size=PAGE_SIZE, fields=SCOPUS_FIELDS, view=None):
+    first = await fetch_page(engine, query, api_key, start=0, page_size=page_size, fields=fields, view=view)
+    if first is None:
+        return None
+
+    total = int(first['search-results'].get('opensearch:totalResults', 0) or 0)
+    entries = page_entries(first)
+
+    if total > START_LIMIT:
+        entries = await fetch_by_cursor(engine, query, api_key, page_size, fields, view)
+        if entries is None:
+            return None
+    elif total > len(entries):
+        pages = await asyncio.gather(*(
+            fetch_page(engine, query, api_key, start=start, page_size=page_size, fields=fields, view=view)
+            for start in range(page_size, total, page_size)
+        ))
+        if any(page is None for page in pages):
+            return None
+        for page in pages:
+            entries.extend(page_entries(page))
+
+    return {'search-results': {'opensearch:totalResults': str(total), 'entry': entries}}
+
+
+async def fetch_author_search(engine, author_id, api_key, page_size=PAGE_SIZE, clause=None):
+    return await fetch_search(engine, with_clause(f'AU-ID({author_id})', clause), api_key, page_size)
+
+
+def batch_query(author_ids, clause=None):
+    return with_clause(' OR '.join(f'AU-ID({author_id})' for author_id in author_ids), clause)
+
+
+# Demultiplex a batched search back into one search response per author. A
+# paper co-authored by several of the queried authors is given to each of them.
+def split_by_author(response_json, author_ids):
+    entries_by_author = {author_id: [] for author_id in author_ids}
+    for entry in response_json['search-results'].get('entry', []):
+        entry_authors = {author.get('authid') for author in entry.get('author', [])}
+        for author_id in entry_authors & entries_by_author.keys():
+            entries_by_author[author_id].append(entry)
+
+    return {
+        author_id: {'search-results': {'opensearch:totalResults': str(len(entries)), 'entry': entries}}
+        for author_id, entries in entries_by_author.items()
+    }
+
+
+async def fetch_author_batch(engine, author_ids, api_key, page_size=PAGE_SIZE, clause=None):
+    response_json = await fetch_search(engine, batch_query(author_ids, clause), api_key, min(page_size, COMPLETE_PAGE_SIZE),
+                                       AUTHOR_FIELDS, AUTHOR_VIEW)
+    if response_json is not None:
+        return split_by_author(response_json, author_ids)
+
+    # The COMPLETE view needs an entitled key; fall back to one search per author
+    print(f"Batched Scopus query failed for {len(author_ids)} authors, retrying them one by one. "
+          "Set SCOPUS_BATCH_SIZE to 0 in config.json if the API key cannot use the COMPLETE view.")
+    responses = await asyncio.gather(*(fetch_author_search(engine, author_id, api_key, page_size, clause) for author_id in author_ids))
+    return dict(zip(author_ids, responses))
+
+
+# Split `author_ids` into batches of up to batch_size authors whose expected
+# result counts (author_id -> papers, e.g. from the last sync) fit one page of
+# `capacity` results between them (a COMPLETE page unless given), and the
+# authors left to search alone: those with no expected count or more papers
+# than a batch page holds. A batch costs one request where its authors alone
+# would cost one each; anything that needs more pages than that is cheaper
+# unbatched.
+def plan_batches(author_ids, expected, batch_size=BATCH_SIZE, capacity=COMPLETE_PAGE_SIZE):
+    batches = []
+    singles = []
+    batch = []
+    batch_papers = 0
+    for author_id in author_ids:
+        papers = expected.get(author_id)
+        if not batch_size or papers is None or papers > capacity:
+            singles.append(author_id)
+            continue
+        if batch and (len(batch) == batch_size or batch_papers + papers > capacity):
+            batches.append(batch)
+            batch, batch_papers = [], 0
+        batch.append(author_id)
+        batch_papers += papers
+    if batch:
+        batches.append(batch)
+    # A batch of one would only be a search in the costlier view
+    singles += [batch[0] for batch in batches if len(batch) == 1]
+    return [batch for batch in batches if len(batch) > 1], singles
+
+
+# Run the searches plan_batches planned, each narrowed by `clause` if given.
+# Returns author_id -> search response (None where the fetch failed).
+async def fetch_planned(engine, batches, singles, api_key, page_size=PAGE_SIZE, clause=None):
+    batch_results, single_results = await asyncio.gather(
+        asyncio.gather(*(fetch_author_batch(engine, batch, api_key, page_size, clause) for batch in batches)),
+        asyncio.gather(*(fetch_author_search(engine, author_id, api_key, page_size, clause) for author_id in singles)),
+    )
+    results = dict(zip(singles, single_results))
+    for batch_result in batch_results:
+        results.update(batch_result)
+    return results
+
+
+# Complete search results for each author, served from the engine's cache when
+# possible. Authors that miss the cache are searched one by one, except those
+# whose `expected` paper counts are small enough to share a batched search
+# (see plan_batches); batch_size 0 never batches. Returns author_id -> search
+# response, each with the time it was fetched under "fetched_at" (kept with it
+# in the cache).
+async def fetch_authors(engine, author_ids, api_key, batch_size=BATCH_SIZE, page_size=PAGE_SIZE, expected=None):
+    async def fetch_missing(engine, missing_ids):
+        batches, singles = plan_batches(missing_ids, expected or {}, batch_size)
+        results = await fetch_planned(engine, batches, singles, api_key, page_size)
+        fetched_at = time.time()
+        for response_json in results.values():
+            if response_json is not None:
+                response_json['fetched_at'] = fetched_at
+        return results
+
+    return await upstream.cached_many(engine, 'scopus', list(dict.fromkeys(author_ids)), fetch_missing)
+
+
+# Papers added to Scopus since `since` for each author, with one batched
+# search per batch_size authors (one per author when batch_size is 0): a few
+# days' new papers of a whole batch usually fit a single COMPLETE page.
+# Returns author_id -> search response with only those papers.
+async def fetch_authors_since(engine, author_ids, since, api_key, batch_size=BATCH_SIZE, page_size=PAGE_SIZE):
+    author_ids = list(dict.fromkeys(author_ids))
+    batches, singles = plan_batches(author_ids, dict.fromkeys(author_ids, 0), batch_size)
+    return await fetch_planned(engine, batches, singles, api_key, page_size, loaded_after(since))
+
+
+# Current citation counts of each author's papers (author_id -> {record
+# identifier -> citedby-count}, None where the search failed), for refreshing
+# stored papers between full syncs. Authors whose `expected` paper counts fill
+# a STANDARD page between them share one search that asks only for the
+# identifier and count, so a batch's refresh is one small request. A paper
+# co-authored by several of them counts for each, so every author of a
+# search is given the whole search's counts.
+async def fetch_citation_counts(engine, author_ids, expected, api_key, batch_size=BATCH_SIZE, page_size=PAGE_SIZE):
+    batches, singles = plan_batches(list(dict.fromkeys(author_ids)), expected, batch_size, page_size)
+    searches = batches + [[author_id] for author_id in singles]
+    responses = await asyncio.gather(*(
+        fetch_search(engine, batch_query(search), api_key, page_size, CITATION_FIELDS) for search in searches
+    ))
+    counts = {}
+    for search, response_json in zip(searches, responses):
+        found = None
+        if response_json is not None:
+            found = {entry.get('dc:identifier'): entry.get('citedby-count') for entry in response_json['search-results']['entry']}
+        counts.update(dict.fromkeys(search, found))
+    return counts
@@ -0,0 +1,63 @@
+import atexit
+import json
+import os
+
+import cache
+import metrics
+import scopus
+import sync
+import throttle
+import upstream
+
+# Load your API key from config.json (GSC_SCO_CONFIG points at another file)
+with open(os.environ.get('GSC_SCO_CONFIG', 'config.json')) as config_file:
+    config = json.load(config_file)
+
+API_KEY = config['API_KEY']
+
+# Per-host concurrency limits for the fetch engine, e.g. {"scholar.google": 2}
+HOST_LIMITS = config.get('HOST_LIMITS', {})
+
+# Per-host token buckets, e.g. {"scholar.google": {"rate": 1, "burst": 3}},
+# and how many times a throttled or failed request is retried
+throttle.configure(config.get('RATE_LIMITS'), config.get('RETRIES', throttle.DEFAULT_RETRIES))
+
+# Operations slower than "slow_seconds" are printed with their tags, e.g.
+# "METRICS": {"slow_seconds": 5}
+metrics.configure(config.get('METRICS'))
+
+# Scopus results per page for single-author (STANDARD view) searches; batched
+# searches use the COMPLETE view, which pages at most 25 results
+SCOPUS_PAGE_SIZE = config.get('SCOPUS_PAGE_SIZE', scopus.PAGE_SIZE)
+
+# Most author IDs OR-ed into one Scopus query, when batching saves requests
+# (see scopus.plan_batches); 0 fetches each author separately
+SCOPUS_BATCH_SIZE = config.get('SCOPUS_BATCH_SIZE', scopus.BATCH_SIZE)
+
+# Disk cache for upstream responses and parsed per-author results; see cache.py
+# for the "CACHE" settings ("CACHE": false turns it off)
+response_cache = cache.Cache.from_config(config.get('CACHE'))
+
+# Local store of per-author paper lists for incremental sync; see sync.py for
+# the "SYNC" settings (off unless "SYNC" is set)
+sync_store = sync.SyncStore.from_config(config.get('SYNC'))
+
+
+# Send an upstream's requests to another server, e.g. the local mock in
+# mock_upstream.py: {"api.elsevier.com": "http://127.0.0.1:8765",
+# "scholar.google": "http://127.0.0.1:8765"}
+UPSTREAM_URLS = config.get('UPSTREAM_URLS', {})
+
+# Shared keep-alive client for every upstream request the process makes; see
+# upstream.Client for the "HTTP_POOL" settings (size, per_host, keepalive,
+# timeout, connect_timeout)
+client = upstream.Client.from_config(HOST_LIMITS, config.get('HTTP_POOL'), UPSTREAM_URLS)
+atexit.register(client.close)
+
+
+def run_upstream(fn, *args, revalidating=False):
+    return client.run(fn, *args, cache=response_cache, revalidating=revalidating)
+
+
+def stream_upstream(fn, *args):
+    return client.stream(fn, *args, cache=response_cache)
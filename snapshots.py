@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'gsc_sco_snapshots.sqlite3')
+
+# Number of snapshot versions kept around; older ones are pruned on save
+DEFAULT_KEEP = 10
+
+# Seconds between the scheduler's refreshes
+DEFAULT_INTERVAL = 6 * 60 * 60
+
+# Snapshots older than this many refresh intervals are no longer served (the
+# scheduler has probably stopped); reports are built live instead
+MAX_AGE_INTERVALS = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    records BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    version INTEGER NOT NULL REFERENCES snapshots (version) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (version, source)
+);
+CREATE TABLE IF NOT EXISTS author_records (
+    version INTEGER NOT NULL REFERENCES snapshots (version) ON DELETE CASCADE,
+    author_id TEXT NOT NULL,
+    record BLOB NOT NULL,
+    PRIMARY KEY (version, author_id)
+);
+'''
+
+
+class SnapshotStore:
+    """Versioned, precomputed report snapshots.
+
+    A snapshot holds the per-author records it was built from (including when
+    each author's Scopus and Scholar data was last refreshed) and one
+    ready-to-serve JSON document per report source, so serving a report is a
+    single row lookup whatever the size of the roster.
+
+    Only a snapshot younger than max_age seconds (None for no limit) is
+    served, and a whole report only when it covers exactly the authors asked
+    for.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, keep=DEFAULT_KEEP, max_age=MAX_AGE_INTERVALS * DEFAULT_INTERVAL):
+        self.path = path
+        self.keep = keep
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # (version, author IDs) of the last snapshot whose coverage was checked
+        self._covered = (None, frozenset())
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, snapshot_config):
+        if snapshot_config is False:
+            return None
+        snapshot_config = snapshot_config or {}
+        max_age = snapshot_config.get('max_age', MAX_AGE_INTERVALS * snapshot_config.get('interval', DEFAULT_INTERVAL))
+        try:
+            return cls(snapshot_config.get('path', DEFAULT_PATH), snapshot_config.get('keep', DEFAULT_KEEP), max_age)
+        except sqlite3.Error as e:
+            print(f"Report snapshots disabled, unable to open the store: {e}")
+            return None
+
+    def save(self, records, reports):
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO snapshots (created_at, records) VALUES (?, ?)',
+                (time.time(), json.dumps(records)),
+            )
+            version = cursor.lastrowid
+            self._db.executemany(
+                'INSERT INTO reports VALUES (?, ?, ?)',
+                [(version, source, json.dumps(rows)) for source, rows in reports.items()],
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO author_records VALUES (?, ?, ?)',
+                [(version, record['id'], json.dumps(record)) for record in records],
+            )
+            self._db.execute('DELETE FROM snapshots WHERE version <= ?', (version - self.keep,))
+            self._db.commit()
+        return version
+
+    # The latest snapshot's version, or None when there is none or it is
+    # older than max_age. Called with the lock held.
+    def _servable_version(self):
+        row = self._db.execute('SELECT version, created_at FROM snapshots ORDER BY version DESC LIMIT 1').fetchone()
+        if row is None or (self.max_age is not None and time.time() - row[1] > self.max_age):
+            return None
+        return row[0]
+
+    # Called with the lock held
+    def _author_ids(self, version):
+        if self._covered[0] != version:
+            rows = self._db.execute('SELECT author_id FROM author_records WHERE version = ?', (version,))
+            self._covered = (version, frozenset(author_id for author_id, in rows))
+        return self._covered[1]
+
+    # Serialized rows of the latest snapshot for `source`, or None when it is
+    # too old or was built for other authors than `author_ids` (e.g. the
+    # roster changed since). The JSON is returned as stored so the route can
+    # send it without re-encoding.
+    def latest_report(self, source, author_ids):
+        with self._lock:
+            version = self._servable_version()
+            if version is None or self._author_ids(version) != set(author_ids):
+                return None
+            row = self._db.execute('SELECT data FROM reports WHERE version = ? AND source = ?', (version, source)).fetchone()
+        return row[0] if row else None
+
+    # Records of the latest snapshot as author_id -> record, used to carry data
+    # over for authors whose refresh failed
+    def latest_records(self):
+        with self._lock:
+            row = self._db.execute('SELECT records FROM snapshots ORDER BY version DESC LIMIT 1').fetchone()
+        return {record['id']: record for record in json.loads(row[0])} if row else {}
+
+    # Records of the given authors in the latest snapshot, as author_id ->
+    # record; authors the snapshot does not cover are left out, and everyone
+    # when it is older than max_age
+    def latest_author_records(self, author_ids):
+        author_ids = list(author_ids)
+        records = {}
+        with self._lock:
+            version = self._servable_version()
+            if version is None:
+                return records
+            # Looked up in chunks to stay under SQLite's limit on query parameters
+            for start in range(0, len(author_ids), 500):
+                chunk = author_ids[start:start + 500]
+                rows = self._db.execute(
+                    f'SELECT author_id, record FROM author_records WHERE version = ? AND author_id IN ({", ".join("?" * len(chunk))})',
+                    (version, *chunk),
+                ).fetchall()
+                records.update((author_id, json.loads(record)) for author_id, record in rows)
+        return records
+
+    # When each author in the latest snapshot was last refreshed, per upstream
+    def refresh_times(self):
+        return {
+            author_id: {
+                upstream: record[upstream]['refreshed_at'] if record[upstream] else None
+                for upstream in ('scopus', 'scholar')
+            }
+            for author_id, record in self.latest_records().items()
+        }
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import metrics
+import scholar
+import scopus
+import upstream
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'gsc_sco_sync.sqlite3')
+
+# Every author's full paper lists are refetched this often; in between only
+# new papers and current citation counts are pulled (for Scopus, the counts
+# of stored papers come from one narrow search per batch of authors)
+DEFAULT_FULL_EVERY = 7 * 24 * 60 * 60
+
+# Authors synced less than this long ago are served from the store as they
+# are, so back-to-back reports do not ask the upstreams again
+DEFAULT_MIN_INTERVAL = 60 * 60
+
+# Date-bounded Scopus queries reach back this far before the last sync, so
+# records indexed a few days late are not missed
+DEFAULT_OVERLAP = 3 * 24 * 60 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS authors (
+    source TEXT NOT NULL,
+    author_key TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL,
+    aggregates BLOB NOT NULL,
+    papers BLOB NOT NULL,
+    PRIMARY KEY (source, author_key)
+);
+'''
+
+
+class SyncStore:
+    """Per-author paper lists and aggregates for incremental sync.
+
+    Each author has one row per upstream ("scopus", keyed by Scopus author ID,
+    and "scholar", keyed by profile link) holding their papers by paper key,
+    the aggregates the reports show, and when they were last synced in full
+    and incrementally.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, full_every=DEFAULT_FULL_EVERY, overlap=DEFAULT_OVERLAP, min_interval=DEFAULT_MIN_INTERVAL):
+        self.path = path
+        self.full_every = full_every
+        self.overlap = overlap
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, sync_config):
+        # Incremental sync is opt-in: "SYNC": true or {"path": ..., "full_every": ..., "overlap": ..., "min_interval": ...}
+        if not sync_config:
+            return None
+        sync_config = sync_config if isinstance(sync_config, dict) else {}
+        try:
+            return cls(
+                path=sync_config.get('path', DEFAULT_PATH),
+                full_every=sync_config.get('full_every', DEFAULT_FULL_EVERY),
+                overlap=sync_config.get('overlap', DEFAULT_OVERLAP),
+                min_interval=sync_config.get('min_interval', DEFAULT_MIN_INTERVAL),
+            )
+        except sqlite3.Error as e:
+            print(f"Incremental sync disabled, unable to open the store: {e}")
+            return None
+
+    def load(self, source, author_key):
+        return self.load_many(source, [author_key])[author_key]
+
+    # author_key -> state (None for authors never synced). Blocking; call it
+    # off the event loop (upstream.in_thread).
+    def load_many(self, source, author_keys):
+        states = dict.fromkeys(author_keys)
+        keys = list(states)
+        with self._lock:
+            # Looked up in chunks to stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    'SELECT author_key, synced_at, full_synced_at, aggregates, papers FROM authors '
+                    f'WHERE source = ? AND author_key IN ({", ".join("?" * len(chunk))})',
+                    (source, *chunk),
+                ).fetchall()
+                for author_key, synced_at, full_synced_at, aggregates, papers in rows:
+                    states[author_key] = {
+                        'synced_at': synced_at,
+                        'full_synced_at': full_synced_at,
+                        'aggregates': json.loads(aggregates),
+                        'papers': json.loads(papers),
+                    }
+        return states
+
+    def save(self, source, author_key, state):
+        self.save_many(source, {author_key: state})
+
+    # Store author_key -> state in one transaction. Blocking, like load_many.
+    def save_many(self, source, states):
+        rows = [
+            (source, author_key, state['synced_at'], state['full_synced_at'],
+             json.dumps(state['aggregates']), json.dumps(state['papers']))
+            for author_key, state in states.items()
+        ]
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._db.commit()
+
+    def needs_full_sync(self, state, now):
+        return state is None or now - state['full_synced_at'] >= self.full_every
+
+    # Whether the author is due a sync at all. A revalidating engine (the
+    # snapshot scheduler's) always syncs.
+    def needs_sync(self, state, now, engine):
+        return engine.revalidating or state is None or now - state['synced_at'] >= self.min_interval
+
+
+def papers_with_at_least(counts, citations):
+    return sum(papers for count, papers in counts.items() if count >= citations)
+
+
+# h-index after some citation counts changed, stepped from its previous value
+# rather than recomputed by sorting every paper. `counts` maps a citation
+# count to the number of papers that have it.
+def update_h_index(h_index, counts):
+    while papers_with_at_least(counts, h_index + 1) >= h_index + 1:
+        h_index += 1
+    while h_index > 0 and papers_with_at_least(counts, h_index) < h_index:
+        h_index -= 1
+    return h_index
+
+
+def new_scopus_state():
+    return {
+        'synced_at': 0,
+        'full_synced_at': 0,
+        'aggregates': {'papers': 0, 'citations': 0, 'h_index': 0, 'counts': {}},
+        'papers': {},
+    }
+
+
+# Merge fetched Scopus papers (key -> paper) into an author's state, applying
+# only the differences to the stored totals and h-index. With complete=True
+# `papers` is the author's whole list and stored papers missing from it are
+# dropped.
+def merge_scopus_papers(state, papers, complete=False):
+    aggregates = state['aggregates']
+    stored = state['papers']
+    counts = Counter({int(count): number for count, number in aggregates['counts'].items()})
+
+    def remove(key):
+        citations = scopus.citation_count(stored.pop(key))
+        counts[citations] -= 1
+        aggregates['citations'] -= citations
+        aggregates['papers'] -= 1
+
+    if complete:
+        for key in set(stored) - set(papers):
+            remove(key)
+    for key, paper in papers.items():
+        if key in stored:
+            if stored[key] == paper:
+                continue
+            remove(key)
+        citations = scopus.citation_count(paper)
+        counts[citations] += 1
+        aggregates['citations'] += citations
+        aggregates['papers'] += 1
+        stored[key] = paper
+
+    aggregates['h_index'] = update_h_index(aggregates['h_index'], counts)
+    aggregates['counts'] = {str(count): number for count, number in counts.items() if number}
+
+
+# Scholar computes the stats table and histogram itself, so those are taken
+# from the profile page as they are; the paper list is merged like Scopus'
+def merge_scholar_profile(state, profile, complete=False):
+    state['aggregates'] = {'stats': profile['stats'], 'yearly_citations': profile['yearly_citations']}
+    papers = {scholar.paper_key(paper): paper for paper in profile['papers']}
+    if complete:
+        state['papers'] = papers
+    else:
+        state['papers'].update(papers)
+
+
+def scopus_papers_by_key(response_json):
+    with metrics.timed(metrics.PARSE_SECONDS, parser='scopus_entries'):
+        return {
+            scopus.paper_key(entry): scopus.parse_scopus_paper(entry)
+            for entry in response_json['search-results'].get('entry', [])
+        }
+
+
+# Bring the citation counts of an author's stored Scopus papers up to date
+# from `counts` (record identifier -> citedby-count); papers missing from it
+# keep their stored count until the next full sync
+def refresh_scopus_citations(state, counts):
+    changed = {
+        key: {**paper, 'citations': counts[key]}
+        for key, paper in state['papers'].items()
+        if key in counts and paper['citations'] != counts[key]
+    }
+    merge_scopus_papers(state, changed)
+
+
+# The Scopus part of a report record, in the shape reports.make_scopus_part builds
+def scopus_part(state):
+    aggregates = state['aggregates']
+    return {
+        'summary': (aggregates['papers'], aggregates['citations'], aggregates['h_index']),
+        # Newest first
+        'papers': sorted(state['papers'].values(), key=lambda paper: paper['year'] or '', reverse=True),
+        'refreshed_at': state['synced_at'],
+    }
+
+
+def scholar_part(state, gscholar_link):
+    return {
+        'profile': {
+            'link': gscholar_link,
+            'stats': state['aggregates']['stats'],
+            'yearly_citations': state['aggregates']['yearly_citations'],
+            # Most cited first, as on the profile page
+            'papers': sorted(state['papers'].values(), key=scopus.citation_count, reverse=True),
+        },
+        'refreshed_at': state['synced_at'],
+    }
+
+
+# Sync the Scopus papers of `author_ids` and return author_id -> record part.
+# Authors synced within the store's min_interval are served as stored.
+# Authors due a full sync get their complete lists; everyone else is asked
+# only for papers loaded since their last sync, in batched searches.
+# Authors whose fetch failed keep the part from their last successful sync
+# (None if there never was one).
+async def sync_scopus(engine, store, author_ids, api_key, batch_size=scopus.BATCH_SIZE, page_size=scopus.PAGE_SIZE):
+    now = time.time()
+    author_ids = list(dict.fromkeys(author_ids))
+    states = await upstream.in_thread(store.load_many, 'scopus', author_ids)
+    due = [author_id for author_id in author_ids if store.needs_sync(states[author_id], now, engine)]
+    full_ids = [author_id for author_id in due if store.needs_full_sync(states[author_id], now)]
+    # A cached response can be days old: merged as a complete list it would
+    # drop newer papers, and as a date-bounded one move synced_at past papers
+    # it never saw, which the overlap then no longer reaches back to
+    engine = engine.revalidating_engine()
+
+    # Authors last synced on the same day share a date bound, and so batches
+    since_days = {}
+    for author_id in due:
+        if author_id not in full_ids:
+            since_day = int((states[author_id]['synced_at'] - store.overlap) // 86400)
+            since_days.setdefault(since_day, []).append(author_id)
+
+    # Authors known to have few papers can share a batched search
+    expected = {author_id: states[author_id]['aggregates']['papers'] for author_id in full_ids if states[author_id] is not None}
+
+    # Stored papers of everyone else get their citation counts refreshed
+    refresh_ids = [author_id for author_id in due if author_id not in full_ids]
+    refresh_expected = {author_id: states[author_id]['aggregates']['papers'] for author_id in refresh_ids}
+
+    async def fetch_full():
+        return await scopus.fetch_authors(engine, full_ids, api_key, batch_size, page_size, expected) if full_ids else {}
+
+    async def fetch_citations():
+        if not refresh_ids:
+            return {}
+        return await scopus.fetch_citation_counts(engine, refresh_ids, refresh_expected, api_key, batch_size, page_size)
+
+    full_results, citations, *new_results = await asyncio.gather(
+        fetch_full(),
+        fetch_citations(),
+        *(scopus.fetch_authors_since(engine, ids, since_day * 86400, api_key, batch_size, page_size)
+          for since_day, ids in since_days.items()),
+    )
+    responses = dict(full_results)
+    for results in new_results:
+        responses.update(results)
+
+    parts = {}
+    changed = {}
+    for author_id in author_ids:
+        state = states[author_id]
+        response_json = responses.get(author_id)
+        counts = citations.get(author_id)
+        if response_json is not None:
+            complete = author_id in full_ids
+            state = state or new_scopus_state()
+            merge_scopus_papers(state, scopus_papers_by_key(response_json), complete)
+            state['synced_at'] = now
+            if complete:
+                state['full_synced_at'] = now
+        if counts is not None:
+            refresh_scopus_citations(state, counts)
+        if response_json is not None or counts is not None:
+            changed[author_id] = state
+        parts[author_id] = scopus_part(state) if state is not None else None
+    if changed:
+        await upstream.in_thread(store.save_many, 'scopus', changed)
+    return parts
+
+
+# Sync one Scholar profile and return its record part. Between full syncs only
+# the newest publications are fetched (one request unless there are many new
+# papers), along with the stats table and histogram on the same page. A
+# profile synced within the store's min_interval is served as stored.
+async def sync_scholar(engine, store, gscholar_link):
+    now = time.time()
+    state = await upstream.in_thread(store.load, 'scholar', gscholar_link)
+    if not store.needs_sync(state, now, engine):
+        return scholar_part(state, gscholar_link)
+    complete = store.needs_full_sync(state, now)
+    # Never from the response cache, as in sync_scopus
+    engine = engine.revalidating_engine()
+    if complete:
+        profile = await scholar.fetch_profile(engine, gscholar_link)
+    else:
+        profile = await scholar.download_recent(engine, gscholar_link, state['papers'].keys())
+
+    if profile is not None and profile['stats']:
+        state = state or {'synced_at': 0, 'full_synced_at': 0, 'aggregates': {}, 'papers': {}}
+        merge_scholar_profile(state, profile, complete)
+        state['synced_at'] = now
+        if complete:
+            state['full_synced_at'] = now
+        await upstream.in_thread(store.save, 'scholar', gscholar_link, state)
+    return scholar_part(state, gscholar_link) if state is not None else None
@@ -0,0 +1,145 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+
+import scopus
+import sync
+import upstream
+
+
+def paper(citations, year=2020):
+    return {'title': f'Paper with {citations}', 'year': str(year), 'citations': str(citations), 'link': None}
+
+
+# The aggregates merge_scopus_papers keeps, computed from scratch
+def recomputed(papers):
+    citations = sorted((scopus.citation_count(paper) for paper in papers.values()), reverse=True)
+    return {
+        'papers': len(citations),
+        'citations': sum(citations),
+        'h_index': sum(count >= rank for rank, count in enumerate(citations, 1)),
+        'counts': {str(count): number for count, number in Counter(citations).items()},
+    }
+
+
+def test_merge_matches_full_recompute():
+    rng = random.Random(7)
+    for _ in range(200):
+        state = sync.new_scopus_state()
+        for _ in range(rng.randint(1, 8)):
+            complete = rng.random() < 0.3
+            keys = [f'SCOPUS_ID:{rng.randint(0, 40)}' for _ in range(rng.randint(0, 30))]
+            papers = {key: paper(rng.choice([0, 1, 2, 3, 5, 8, 10, 13, 40, 200])) for key in keys}
+            sync.merge_scopus_papers(state, papers, complete)
+            assert state['aggregates'] == recomputed(state['papers'])
+
+
+def test_complete_merge_replaces_and_incremental_merge_adds():
+    state = sync.new_scopus_state()
+    sync.merge_scopus_papers(state, {'a': paper(5), 'b': paper(3)}, complete=True)
+
+    sync.merge_scopus_papers(state, {'c': paper(1)})
+    assert set(state['papers']) == {'a', 'b', 'c'}
+
+    sync.merge_scopus_papers(state, {'a': paper(6), 'd': paper(2)}, complete=True)
+    assert set(state['papers']) == {'a', 'd'}
+    assert state['aggregates'] == recomputed(state['papers'])
+
+
+def test_refresh_citations_updates_totals():
+    state = sync.new_scopus_state()
+    sync.merge_scopus_papers(state, {'a': paper(1), 'b': paper(1), 'c': paper(0)}, complete=True)
+    sync.refresh_scopus_citations(state, {'a': '9', 'b': '4', 'gone': '50'})
+    assert state['papers']['a']['citations'] == '9'
+    assert state['aggregates'] == recomputed(state['papers'])
+    assert state['aggregates']['h_index'] == 2
+
+
+def entry(identifier, citations, year=2020):
+    return {'dc:identifier': identifier, 'dc:title': identifier, 'prism:coverDate': f'{year}-01-01',
+            'citedby-count': str(citations)}
+
+
+def response(*entries):
+    return {'search-results': {'opensearch:totalResults': str(len(entries)), 'entry': list(entries)}}
+
+
+class FakeScopus:
+    """Stands in for the scopus fetch functions sync_scopus calls, serving a
+    fixed set of entries per author and recording which kind of fetch ran."""
+
+    def __init__(self, monkeypatch, entries):
+        self.entries = entries
+        self.calls = []
+        monkeypatch.setattr(scopus, 'fetch_authors', self.fetch_authors)
+        monkeypatch.setattr(scopus, 'fetch_authors_since', self.fetch_authors_since)
+        monkeypatch.setattr(scopus, 'fetch_citation_counts', self.fetch_citation_counts)
+
+    async def fetch_authors(self, engine, author_ids, *args):
+        assert engine.revalidating
+        self.calls.append(('full', list(author_ids)))
+        return {author_id: response(*self.entries[author_id]) for author_id in author_ids}
+
+    async def fetch_authors_since(self, engine, author_ids, since, *args):
+        assert engine.revalidating
+        self.calls.append(('since', list(author_ids)))
+        return {author_id: response(*self.entries[author_id][-1:]) for author_id in author_ids}
+
+    async def fetch_citation_counts(self, engine, author_ids, expected, *args):
+        self.calls.append(('citations', list(author_ids)))
+        return {author_id: {item['dc:identifier']: item['citedby-count'] for item in self.entries[author_id]}
+                for author_id in author_ids}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return sync.SyncStore(str(tmp_path / 'sync.sqlite3'), full_every=3600, min_interval=0)
+
+
+def run_sync(store, author_ids, revalidating=False):
+    engine = upstream.FetchEngine(None, revalidating=revalidating)
+    return asyncio.run(sync.sync_scopus(engine, store, author_ids, 'key'))
+
+
+def test_sync_scopus_full_then_incremental(monkeypatch, store):
+    fake = FakeScopus(monkeypatch, {'1': [entry('a', 5), entry('b', 3)]})
+    parts = run_sync(store, ['1'])
+    assert fake.calls == [('full', ['1'])]
+    assert parts['1']['summary'] == (2, 8, 2)
+
+    # A new paper and a changed count between full syncs: merged, nothing dropped
+    fake.entries['1'] = [entry('a', 7), entry('b', 3), entry('c', 1)]
+    fake.calls.clear()
+    parts = run_sync(store, ['1'])
+    assert sorted(kind for kind, _ in fake.calls) == ['citations', 'since']
+    assert parts['1']['summary'] == (3, 11, 2)
+
+
+def test_sync_scopus_full_sync_drops_removed_papers(monkeypatch, store):
+    fake = FakeScopus(monkeypatch, {'1': [entry('a', 5), entry('b', 3)]})
+    run_sync(store, ['1'])
+
+    store.full_every = 0
+    fake.entries['1'] = [entry('a', 5)]
+    parts = run_sync(store, ['1'])
+    assert fake.calls[-1] == ('full', ['1'])
+    assert [paper['title'] for paper in parts['1']['papers']] == ['a']
+    assert parts['1']['summary'] == (1, 5, 1)
+
+
+def test_sync_scopus_skips_recently_synced_authors(monkeypatch, store):
+    fake = FakeScopus(monkeypatch, {'1': [entry('a', 5)], '2': [entry('b', 2)]})
+    run_sync(store, ['1'])
+
+    store.min_interval = 3600
+    fake.calls.clear()
+    parts = run_sync(store, ['1', '2'])
+    assert fake.calls == [('full', ['2'])]
+    assert parts['1']['summary'] == (1, 5, 1)
+
+    # The scheduler's revalidating engine syncs everyone
+    fake.calls.clear()
+    run_sync(store, ['1', '2'], revalidating=True)
+    assert {kind for kind, _ in fake.calls} == {'citations', 'since'}
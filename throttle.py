@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+
+# Sustained requests per second and burst size per upstream host. The rate is
+# a ceiling: it is halved on every 429 and creeps back up on success.
+DEFAULT_RATE_LIMITS = {
+    'api.elsevier.com': {'rate': 8, 'burst': 8},
+    'scholar.google': {'rate': 1, 'burst': 3},
+}
+DEFAULT_RATE_LIMIT = {'rate': 4, 'burst': 4}
+
+# Retries for 429, 5xx and network errors, with jittered exponential backoff
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Waits longer than this (e.g. a Scopus weekly quota reset) are not slept
+# through; the host's circuit is opened until then instead
+MAX_WAIT = 120.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Pages Scholar serves instead of results once it suspects scraping
+CAPTCHA_MARKERS = {
+    'scholar.google': [b'Our systems have detected unusual traffic', b'id="gs_captcha_ccl"'],
+}
+CAPTCHA_COOLDOWN = 15 * 60
+CAPTCHA_COOLDOWN_MAX = 4 * 60 * 60
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every event loop in the process.
+
+    acquire() reserves a token and returns how long the caller has to wait for
+    it, so async callers can sleep without holding any lock.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(delay, self.paused_until - now)
+
+    # Seconds left of a pause, for callers whose token was reserved before it
+    # was set
+    def paused_for(self):
+        with self._lock:
+            return max(0.0, self.paused_until - time.monotonic())
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    # AIMD: halve the rate when throttled, grow it back slowly on success
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate / 32, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    def __init__(self, cooldown=CAPTCHA_COOLDOWN, max_cooldown=CAPTCHA_COOLDOWN_MAX):
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return time.time() >= self.open_until
+
+    # Open the circuit for `seconds`, or for the current cooldown, which doubles
+    # every time the circuit is tripped again without a success in between
+    def trip(self, seconds=None):
+        with self._lock:
+            if seconds is None:
+                seconds = self.cooldown
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self.open_until = max(self.open_until, time.time() + seconds)
+
+    def succeeded(self):
+        self.cooldown = self.base_cooldown
+
+
+class HostThrottle:
+    def __init__(self, key, rate, burst, retries=DEFAULT_RETRIES):
+        self.key = key
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        self.retries = retries
+        self.captcha_markers = CAPTCHA_MARKERS.get(key, [])
+
+    def is_captcha(self, response):
+        return '/sorry/' in response.url or any(marker in response.body for marker in self.captcha_markers)
+
+    # Seconds to wait before retrying `response`, from Retry-After or the Scopus
+    # quota headers when present, otherwise jittered exponential backoff
+    def retry_delay(self, response, attempt):
+        headers = response.headers if response is not None else {}
+        retry_after = headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        if headers.get('X-RateLimit-Remaining') == '0' and headers.get('X-RateLimit-Reset', '').isdigit():
+            return max(0.0, int(headers['X-RateLimit-Reset']) - time.time())
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    # Update the bucket from a completed request; returns True when it should
+    # be retried
+    def observe(self, response):
+        if response.status == 429:
+            self.bucket.throttled()
+        elif response.ok:
+            self.bucket.succeeded()
+            self.breaker.succeeded()
+        # Scopus reports the remaining quota on every response; stop before we
+        # hit zero rather than burning requests on 429s
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset = response.headers.get('X-RateLimit-Reset', '')
+            if reset.isdigit():
+                self.wait_or_trip(int(reset) - time.time())
+        return response.status in RETRY_STATUSES
+
+    # Hold every request to this host back for `seconds`, or open the circuit
+    # when that is too long to wait for
+    def wait_or_trip(self, seconds):
+        if seconds > MAX_WAIT:
+            self.breaker.trip(seconds)
+        elif seconds > 0:
+            self.bucket.pause(seconds)
+
+
+_throttles = {}
+_rate_limits = dict(DEFAULT_RATE_LIMITS)
+_retries = DEFAULT_RETRIES
+_lock = threading.Lock()
+
+
+# Override the per-host limits, e.g. from "RATE_LIMITS" in config.json
+def configure(rate_limits=None, retries=DEFAULT_RETRIES):
+    global _retries
+    with _lock:
+        _rate_limits.update(rate_limits or {})
+        _retries = retries
+        _throttles.clear()
+
+
+def for_host(key):
+    with _lock:
+        if key not in _throttles:
+            limits = _rate_limits.get(key, DEFAULT_RATE_LIMIT)
+            _throttles[key] = HostThrottle(key, limits['rate'], limits.get('burst', limits['rate']), _retries)
+        return _throttles[key]
@@ -0,0 +1,490 @@
+import asyncio
+import contextvars
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from multidict import CIMultiDict
+
+import metrics
+import throttle
+from cache import FRESH, STALE
+
+# Maximum number of in-flight requests per upstream host. Scholar is far less
+# tolerant of parallel scraping than the Scopus API, so it gets a small limit.
+DEFAULT_HOST_LIMITS = {
+    'api.elsevier.com': 8,
+    'scholar.google': 2,
+}
+DEFAULT_LIMIT = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 10
+
+# Seconds between checks on keys another worker process is fetching, doubling
+# up to the maximum while it takes longer
+LEASE_POLL = 0.05
+LEASE_POLL_MAX = 1.0
+
+# Longest a request waiting for its rate-limit token sleeps before checking
+# whether its host has been paused or its circuit opened
+WAIT_POLL = 1.0
+
+# Keep-alive connection pool: total connections, connections per host and
+# how long an idle connection is kept open
+DEFAULT_POOL_SIZE = 64
+DEFAULT_POOL_SIZE_PER_HOST = 16
+DEFAULT_KEEPALIVE = 60
+
+
+def host_key(url):
+    host = urlsplit(url).hostname or ''
+    # scholar.google.com, scholar.google.co.in, ... are all the same upstream
+    if host.startswith('scholar.google.'):
+        return 'scholar.google'
+    return host
+
+
+# Point `url` at another server, keeping its path and query; used to send
+# requests to a local mock upstream (see mock_upstream.py)
+def rebase_url(url, base_url):
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip('/') + parts.path, parts.query, parts.fragment))
+
+
+class Response:
+    def __init__(self, url, status, body=b'', headers=None):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.headers = CIMultiDict(headers or {})
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Client:
+    """Process-wide upstream HTTP client shared by app.py and combine.py.
+
+    The client owns one aiohttp session with a keep-alive connection pool,
+    living on a background event loop thread that is started on first use (so
+    it is created after gunicorn forks its workers). Connections are reused
+    across every request and report the process makes instead of paying a new
+    TCP+TLS handshake each time.
+
+    Async face: coroutine functions ``fn(engine, *args)`` get a FetchEngine
+    and can fan out requests with ``asyncio.gather``; run them with run() or
+    stream(). Sync face: get() performs a single request and blocks.
+
+    Concurrent fetches of the same key (see single_flight_many) are made once
+    for the whole process, whichever thread or report asked for them.
+
+    ``base_urls`` maps upstream hosts (as returned by host_key) to another
+    server to send their requests to instead. Throttling, caching and logging
+    still use the original URL.
+    """
+
+    def __init__(self, host_limits=None, timeout=DEFAULT_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 pool_size=DEFAULT_POOL_SIZE, pool_size_per_host=DEFAULT_POOL_SIZE_PER_HOST, keepalive=DEFAULT_KEEPALIVE,
+                 base_urls=None):
+        self.host_limits = dict(DEFAULT_HOST_LIMITS)
+        self.host_limits.update(host_limits or {})
+        self.base_urls = dict(base_urls or {})
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive = keepalive
+        self._loop = None
+        self._session = None
+        self._semaphores = {}
+        # (namespace, key) -> future of the fetch in flight for it; only used
+        # on the client's loop
+        self.inflight = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, host_limits=None, pool_config=None, base_urls=None):
+        pool_config = pool_config or {}
+        return cls(
+            host_limits=host_limits,
+            base_urls=base_urls,
+            timeout=pool_config.get('timeout', DEFAULT_TIMEOUT),
+            connect_timeout=pool_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            pool_size=pool_config.get('size', DEFAULT_POOL_SIZE),
+            pool_size_per_host=pool_config.get('per_host', DEFAULT_POOL_SIZE_PER_HOST),
+            keepalive=pool_config.get('keepalive', DEFAULT_KEEPALIVE),
+        )
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='upstream-client', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(with_context(contextvars.copy_context(), coro), self._ensure_loop())
+
+    def _open_session(self):
+        if self._session is None:
+            # aiohttp takes a quarter of a second to import, which pages that
+            # make no upstream requests should not pay for on a cold start
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    def _semaphore(self, url):
+        key = host_key(url)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.host_limits.get(key, DEFAULT_LIMIT))
+        return self._semaphores[key]
+
+    async def request(self, url, headers=None, params=None):
+        # Network failures are reported as a Response with status None so that
+        # callers only have to check `response.ok`
+        import aiohttp
+
+        session = self._open_session()
+        host = host_key(url)
+        base_url = self.base_urls.get(host)
+        target = rebase_url(url, base_url) if base_url else url
+        async with self._semaphore(url):
+            with metrics.timed(metrics.UPSTREAM_REQUEST_SECONDS, host=host, status='error') as labels:
+                try:
+                    async with session.get(target, headers=headers, params=params) as response:
+                        body = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"Error requesting {url}: {e}")
+                    return Response(url, None)
+                labels['status'] = response.status
+
+        info = response.request_info
+        metrics.UPSTREAM_REQUEST_BYTES.inc(len(str(info.url)) + sum(len(k) + len(v) + 4 for k, v in info.headers.items()), host=host)
+        metrics.UPSTREAM_RESPONSE_BYTES.inc(len(body), host=host)
+        return Response(str(response.url), response.status, body, response.headers)
+
+    async def _run(self, fn, args, cache, revalidating):
+        return await fn(FetchEngine(self, cache, revalidating), *args)
+
+    # Run the coroutine function `fn(engine, *args)` on the client's loop and
+    # wait for its result
+    def run(self, fn, *args, cache=None, revalidating=False):
+        return self._submit(self._run(fn, args, cache, revalidating)).result()
+
+    # Generator over the items the coroutine function `fn(engine, emit, *args)`
+    # passes to `emit`, yielded while it is still running
+    def stream(self, fn, *args, cache=None, revalidating=False):
+        items = queue.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                await fn(FetchEngine(self, cache, revalidating), items.put, *args)
+            except Exception as e:
+                print(f"Error while streaming upstream results: {e}")
+            finally:
+                items.put(done)
+
+        self._submit(produce())
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            yield item
+
+    def get(self, url, headers=None, params=None, cache=None, cache_source=None):
+        async def fetch(engine):
+            return await engine.get(url, headers, params, cache_source)
+
+        return self.run(fetch, cache=cache)
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+
+class FetchEngine:
+    """One unit of work (a report, a refresh, a single call) on a Client.
+
+    Every request goes through the client's semaphore for its upstream host, so
+    callers can fire off all of a report's requests at once with
+    ``asyncio.gather`` and each host stays within its concurrency limit.
+
+    With a cache, requests made with a ``cache_source`` are served from it.
+    A revalidating engine is the one used for background refreshes: it skips
+    cache lookups but still stores what it fetches.
+    """
+
+    def __init__(self, client, cache=None, revalidating=False):
+        self.client = client
+        self.cache = cache
+        self.revalidating = revalidating
+
+    # An engine on the same client and cache that skips cache lookups, for
+    # fetches that must see the upstream as it is now
+    def revalidating_engine(self):
+        return self if self.revalidating else FetchEngine(self.client, self.cache, True)
+
+    async def get(self, url, headers=None, params=None, cache_source=None):
+        if self.cache is None or cache_source is None:
+            return await self._get(url, headers, params)
+
+        key = cache_key(url, params)
+        failures = []
+
+        async def fetch_body(engine, keys):
+            response = await engine._get(url, headers, params)
+            if not response.ok:
+                failures.append(response)
+                return {key: None}
+            return {key: response.body}
+
+        bodies = await cached_many(self, cache_source, [key], fetch_body)
+        if bodies[key] is None:
+            return failures[0] if failures else Response(url, None)
+        return Response(url, 200, bodies[key])
+
+    # GET through the host's throttle: rate limited, retried with backoff on
+    # 429/5xx and network errors, and refused outright while the host's
+    # circuit is open (e.g. after Scholar served a CAPTCHA)
+    async def _get(self, url, headers=None, params=None):
+        gate = throttle.for_host(host_key(url))
+        response = None
+        for attempt in range(gate.retries + 1):
+            if not await wait_turn(gate):
+                print(f"Skipping {url}: requests to {gate.key} are paused")
+                metrics.UPSTREAM_REFUSED.inc(host=gate.key)
+                return Response(url, None)
+
+            response = await self.client.request(url, headers, params)
+
+            if response.status is not None:
+                if gate.is_captcha(response):
+                    gate.breaker.trip()
+                    metrics.UPSTREAM_CAPTCHAS.inc(host=gate.key)
+                    print(f"CAPTCHA detected at {url}; pausing requests to {gate.key}")
+                    return Response(response.url, None)
+                if not gate.observe(response):
+                    return response
+
+            if attempt == gate.retries:
+                break
+            metrics.UPSTREAM_RETRIES.inc(host=gate.key, reason=response.status or 'error')
+            delay = gate.retry_delay(response, attempt)
+            if response.status == 429:
+                # Throttling applies to the whole host, not just this request
+                gate.wait_or_trip(delay)
+            elif delay > throttle.MAX_WAIT:
+                break
+            else:
+                await asyncio.sleep(delay)
+        return response
+
+
+# Wait for a token from the host's bucket. A CAPTCHA or a 429 on another
+# request may stop the host meanwhile, so the circuit and the bucket's pause
+# are checked at least every WAIT_POLL seconds until the token is due.
+# Returns False when the circuit is open.
+async def wait_turn(gate):
+    due = time.monotonic() + gate.bucket.acquire()
+    while gate.breaker.allow():
+        delay = max(due - time.monotonic(), gate.bucket.paused_for())
+        if delay <= 0:
+            return True
+        await asyncio.sleep(min(delay, WAIT_POLL))
+    return False
+
+
+# Run `coro` with the context variables (e.g. metrics tags) of the thread that
+# submitted it to the client's loop
+async def with_context(context, coro):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+# Run a blocking cache call on a worker thread. Cache calls are SQLite reads
+# and writes that may also wait on other processes' transactions; on the
+# client's loop they would stall every other fetch in flight.
+async def in_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def cache_key(url, params=None):
+    return f'{url}?{urlencode(sorted(params.items()))}' if params else url
+
+
+# Run `fn(engine, keys)`, which returns a dict of key -> value, once for each
+# key concurrent callers in this process ask for under `namespace`. Keys that
+# another caller is already fetching are not fetched again: their result (or
+# exception) is shared with everyone waiting for it.
+async def single_flight_many(engine, namespace, keys, fn):
+    inflight = engine.client.inflight
+    led = {}
+    waiting = {}
+    for key in dict.fromkeys(keys):
+        if (namespace, key) in inflight:
+            waiting[key] = inflight[(namespace, key)]
+        else:
+            led[key] = inflight[(namespace, key)] = asyncio.get_running_loop().create_future()
+    if waiting:
+        metrics.COALESCED.inc(len(waiting), source=namespace, scope='process')
+
+    async def lead():
+        if not led:
+            return {}
+        try:
+            fetched = await fn(engine, list(led))
+        except BaseException as e:
+            for key, future in led.items():
+                del inflight[(namespace, key)]
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    # Retrieved, so no "never retrieved" warning without waiters
+                    future.exception()
+            raise
+        for key, future in led.items():
+            del inflight[(namespace, key)]
+            future.set_result(fetched.get(key))
+        return {key: fetched.get(key) for key in led}
+
+    async def follow():
+        results = {}
+        orphaned = []
+        for key, future in waiting.items():
+            try:
+                # Shielded: a waiter being cancelled must not cancel the fetch
+                results[key] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller fetching it was cancelled
+                orphaned.append(key)
+        if orphaned:
+            results.update(await single_flight_many(engine, namespace, orphaned, fn))
+        return results
+
+    fetched, shared = await asyncio.gather(lead(), follow())
+    return {**fetched, **shared}
+
+
+# Single-key form of single_flight_many for `fn(engine, *args)` returning one value
+async def single_flight(engine, namespace, key, fn, *args):
+    async def fetch(engine, keys):
+        return {key: await fn(engine, *args)}
+
+    return (await single_flight_many(engine, namespace, [key], fetch))[key]
+
+
+# Fetch `keys` with `fn(engine, keys)` and store them in the cache, holding a
+# lease on each key in the cache database meanwhile so that worker processes
+# sharing the cache fetch every key once between them. Keys another worker
+# holds the lease on are waited for and read from the cache when it is done
+# (and fetched here if it failed). A background refresh skips them instead and
+# leaves storing to Cache.revalidate.
+async def fetch_leased(engine, source, keys, fn, background=False):
+    cache = engine.cache
+    led = await in_thread(cache.acquire, source, keys)
+    others = [key for key in keys if key not in set(led)]
+    results = {}
+
+    if led:
+        try:
+            fetched = await fn(engine, led)
+            results.update((key, fetched.get(key)) for key in led)
+            if not background:
+                await in_thread(cache.store_many, source, {key: results[key] for key in led if results[key] is not None})
+        finally:
+            await in_thread(cache.release, source, led)
+
+    if others and not background:
+        metrics.COALESCED.inc(len(others), source=source, scope='worker')
+        pending = others
+        poll = LEASE_POLL
+        while pending:
+            await asyncio.sleep(poll)
+            poll = min(poll * 2, LEASE_POLL_MAX)
+            pending = await in_thread(cache.leased, source, pending)
+        stored = await in_thread(cache.lookup_many, source, others)
+        failed = []
+        for key in others:
+            results[key] = stored[key][0]
+            if results[key] is None:
+                failed.append(key)
+        if failed:
+            fetched = await fn(engine, failed)
+            results.update((key, fetched.get(key)) for key in failed)
+            await in_thread(cache.store_many, source, {key: results[key] for key in failed if results[key] is not None})
+
+    return results
+
+
+# Read-through cache for a set of keys. `fn(engine, keys)` fetches the missing
+# keys and returns a dict of key -> value; None values are not cached. Stale
+# entries are returned immediately and refreshed on a background thread.
+# Misses are fetched once however many callers (or worker processes sharing
+# the cache) want them at the same time.
+async def cached_many(engine, source, keys, fn):
+    cache = engine.cache
+    if cache is None:
+        return await single_flight_many(engine, source, keys, fn)
+
+    results = {}
+    stale = []
+    missing = []
+    found = {} if engine.revalidating else await in_thread(cache.lookup_many, source, keys)
+    for key in keys:
+        value, state = found.get(key, (None, None))
+        if state == FRESH:
+            results[key] = value
+        elif state == STALE:
+            results[key] = value
+            stale.append(key)
+        else:
+            missing.append(key)
+
+    if stale:
+        cache.revalidate(source, stale, lambda keys: engine.client.run(
+            fetch_leased, source, keys, fn, True, cache=cache, revalidating=True))
+
+    if missing:
+        results.update(await single_flight_many(
+            engine, source, missing, lambda engine, keys: fetch_leased(engine, source, keys, fn)))
+
+    return results
+
+
+# Single-key form of cached_many for `fn(engine, *args)` returning one value
+async def cached(engine, source, key, fn, *args):
+    async def fetch(engine, keys):
+        return {key: await fn(engine, *args)}
+
+    return (await cached_many(engine, source, [key], fetch))[key]